@@ -6,21 +6,34 @@ Simula la experiencia de un canal tradicional en chats privados
 
 import logging
 import os
+import re
+import json
 import sqlite3
 import asyncio
-from typing import Optional, List, Dict, Any, Union
+import threading
+import time
+import functools
+import contextlib
+import atexit
+import queue
+import random
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Union, Tuple
 from datetime import datetime
-from collections import defaultdict
+from urllib.parse import quote
+from collections import defaultdict, OrderedDict, Counter
+from http.server import HTTPServer, SimpleHTTPRequestHandler
 
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup, 
     LabeledPrice, PreCheckoutQuery, Message, InputPaidMediaPhoto, 
     InputPaidMediaVideo, InputMediaPhoto, InputMediaVideo, InputMediaDocument,
-    BotCommand
+    BotCommand, BotCommandScopeChat, BotCommandScopeDefault, User
 )
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
-    MessageHandler, filters, ContextTypes, PreCheckoutQueryHandler
+    MessageHandler, filters, ContextTypes, PreCheckoutQueryHandler, AIORateLimiter
 )
 
 # Cargar variables de entorno desde archivo .env si existe
@@ -31,6 +44,23 @@ except ImportError:
     # python-dotenv no instalado, continuar sin él
     pass
 
+# Serialización JSON de los media_group: orjson (extensión en C) si está instalado
+try:
+    import orjson
+    
+    def json_dumps(obj: Any) -> str:
+        """Serializa a JSON en UTF-8 sin escapar caracteres no ASCII"""
+        return orjson.dumps(obj).decode()
+    
+    json_loads = orjson.loads
+except ImportError:
+    # orjson no instalado, usar el módulo json estándar
+    def json_dumps(obj: Any) -> str:
+        """Serializa a JSON en UTF-8 sin escapar caracteres no ASCII"""
+        return json.dumps(obj, ensure_ascii=False)
+    
+    json_loads = json.loads
+
 # Configurar logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -41,16 +71,263 @@ logger = logging.getLogger(__name__)
 # Configuración
 BOT_TOKEN = os.getenv('BOT_TOKEN', '')
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', '0'))
-DATABASE_NAME = 'bot_content.db'
+
+def parse_admin_ids(admin_ids: str) -> frozenset:
+    """Convierte una lista de IDs separados por comas; las entradas no numéricas se avisan y se ignoran"""
+    parsed = set()
+    for admin_id in admin_ids.split(','):
+        admin_id = admin_id.strip()
+        if not admin_id:
+            continue
+        if not admin_id.isdecimal():
+            logger.warning(f"ADMIN_USER_IDS: ID de administrador inválido ignorado: {admin_id!r}")
+            continue
+        if int(admin_id) != 0:
+            parsed.add(int(admin_id))
+    return frozenset(parsed)
+
+# Administradores: ADMIN_USER_ID más los IDs separados por comas de ADMIN_USER_IDS, resueltos una vez al arrancar
+ADMIN_USER_IDS = parse_admin_ids(f"{ADMIN_USER_ID},{os.getenv('ADMIN_USER_IDS', '')}")
+DATABASE_NAME = os.getenv('DATABASE_NAME', 'bot_content.db')  # ruta del archivo SQLite
+SQLITE_PAGE_SIZE = 8192  # bytes por página; solo se aplica al crear la base de datos
+CONTENT_LIST_TTL = 30  # segundos que se reutiliza la lista de contenido en memoria
+CONTENT_CACHE_SIZE = 256  # máximo de contenidos individuales en memoria
+STATS_TTL = 15  # segundos que se reutilizan las estadísticas del panel de admin
+WRITE_FLUSH_INTERVAL = 0.05  # segundos que se esperan escrituras para agruparlas
+WRITE_BATCH_SIZE = 64  # máximo de escrituras por transacción
+PURCHASE_WRITE_ATTEMPTS = 5  # intentos de guardar un lote de compras antes de apartarlo en disco
+PENDING_PURCHASES_FILE = f'{DATABASE_NAME}.pending'  # compras cobradas que no se pudieron guardar
+CATALOG_MARKUP_CACHE_SIZE = 256  # máximo de teclados de catálogo en memoria
+CONTENT_PARTS_CACHE_SIZE = 256  # máximo de publicaciones con sus piezas de envío ya construidas
+SQLITE_BUSY_TIMEOUT_MS = 5000  # espera máxima por el bloqueo de escritura de SQLite
+KNOWN_USERS_CACHE_SIZE = 10000  # usuarios recordados para no reescribirlos en cada /start
+PURCHASE_CACHE_SIZE = 10000  # usuarios cuyas compras se mantienen en memoria
+USER_CONTENT_TTL = 300  # segundos que se conserva en user_data el contenido visto
+CATALOG_PAGE_SIZE = 10  # contenidos por página en /catalogo
+USER_BATCH_SIZE = 500  # usuarios leídos por consulta al recorrer todos los usuarios
+BROADCAST_CONCURRENCY = 25  # envíos simultáneos al difundir a todos los usuarios
+BROADCAST_RATE = 30  # mensajes por segundo como máximo (límite global de Telegram)
+BROADCAST_MAX_ATTEMPTS = 5  # intentos por usuario ante 429 o errores de red
+BROADCAST_PROGRESS_EVERY = 100  # usuarios entre cada actualización del progreso
+HTTP_POOL_SIZE = 64  # conexiones HTTP reutilizables hacia la API de Telegram
+VACUUM_INTERVAL = 3600  # segundos entre pasadas de incremental_vacuum
+VACUUM_PAGES = 1000  # páginas libres devueltas como máximo en cada pasada
+
+# Prefijos de callback_data y del payload de pago que llevan un ID de contenido
+UNLOCK_PREFIX = "unlock_"
+VIEW_PREFIX = "view_content_"
+MANAGE_PREFIX = "manage_content_"
+DELETE_PREFIX = "delete_content_"
+CONFIRM_DELETE_PREFIX = "confirm_delete_"
+PAYLOAD_PREFIX = "content_"
+# Prefijo de callback_data con el número de página del catálogo
+CATALOG_PAGE_PREFIX = "catalog_page_"
+
+# Tipo de contenido -> (método del bot, parámetro del archivo) para envíos sin restricciones
+MEDIA_SENDERS = {
+    'photo': ('send_photo', 'photo'),
+    'video': ('send_video', 'video'),
+    'document': ('send_document', 'document'),
+}
+
+# Esquema completo: se crea en una sola llamada a executescript
+_SQL_SCHEMA = '''
+-- Tabla de contenido
+CREATE TABLE IF NOT EXISTS content (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    description TEXT,
+    media_type TEXT,
+    media_file_id TEXT,
+    price_stars INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_active BOOLEAN DEFAULT 1
+);
+
+-- Tabla de usuarios
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_active BOOLEAN DEFAULT 1
+);
+
+-- Tabla de compras
+CREATE TABLE IF NOT EXISTS purchases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    content_id INTEGER,
+    stars_paid INTEGER,
+    payment_id TEXT,
+    purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (user_id),
+    FOREIGN KEY (content_id) REFERENCES content (id)
+);
+
+-- Tabla de configuraciones
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Índices para las consultas más frecuentes
+CREATE INDEX IF NOT EXISTS idx_purchases_user_content
+ON purchases (user_id, content_id);
+CREATE INDEX IF NOT EXISTS idx_purchases_content
+ON purchases (content_id);
+-- Difusiones: recorrido por lotes de usuarios activos (el user_id implícito al final da el orden)
+CREATE INDEX IF NOT EXISTS idx_users_active
+ON users (is_active);
+-- Catálogo en orden de publicación; el id implícito al final del índice desempata
+-- el contenido publicado en el mismo segundo sin ordenamiento temporal
+DROP INDEX IF EXISTS idx_content_active_created;
+CREATE INDEX IF NOT EXISTS idx_content_active_created_id
+ON content (is_active, created_at);
+-- Listado de admin (incluye inactivos)
+CREATE INDEX IF NOT EXISTS idx_content_created
+ON content (created_at);
+
+-- Vista con las columnas que se muestran del contenido
+CREATE VIEW IF NOT EXISTS v_content AS
+SELECT id, title, description, media_type, media_file_id, price_stars, is_active, created_at
+FROM content;
+'''
+
+# Consultas frecuentes: el texto fijo permite reutilizar la sentencia ya
+# preparada en la caché de la conexión (cached_statements)
+_SQL_REGISTER_USER = '''
+INSERT INTO users (user_id, username, first_name, last_name)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    username = excluded.username,
+    first_name = excluded.first_name,
+    last_name = excluded.last_name
+WHERE users.username IS NOT excluded.username
+   OR users.first_name IS NOT excluded.first_name
+   OR users.last_name IS NOT excluded.last_name
+'''
+# Una sentencia por caso (incluye_inactivos -> SQL): con un filtro "(? = 1 OR is_active = 1)"
+# SQLite no puede usar los índices y recorre la tabla entera más un ordenamiento temporal.
+# EXPLAIN QUERY PLAN esperado:
+#   False -> SEARCH content USING INDEX idx_content_active_created_id (is_active=?)
+#   True  -> SCAN content USING INDEX idx_content_created
+_SQL_CONTENT_LIST = {
+    False: '''
+SELECT id, title, description, media_type, media_file_id, price_stars, is_active
+FROM v_content
+WHERE is_active = 1
+ORDER BY created_at ASC, id ASC
+''',
+    True: '''
+SELECT id, title, description, media_type, media_file_id, price_stars, is_active
+FROM v_content
+ORDER BY created_at ASC, id ASC
+''',
+}
+_SQL_CONTENT_PAGE = {
+    include_inactive: sql + '''LIMIT ? OFFSET ?
+'''
+    for include_inactive, sql in _SQL_CONTENT_LIST.items()
+}
+_SQL_CONTENT_COUNT = {
+    False: 'SELECT COUNT(*) FROM content WHERE is_active = 1',
+    True: 'SELECT COUNT(*) FROM content',
+}
+_SQL_USER_BATCH = '''
+SELECT user_id FROM users
+WHERE is_active = 1 AND user_id > ?
+ORDER BY user_id
+LIMIT ?
+'''
+_SQL_USER_PURCHASES = '''
+SELECT content_id FROM purchases WHERE user_id = ?
+'''
+_SQL_CONTENT_BUYERS = '''
+SELECT DISTINCT user_id FROM purchases WHERE content_id = ?
+'''
+_SQL_INSERT_PURCHASE = '''
+INSERT OR IGNORE INTO purchases (user_id, content_id, stars_paid, payment_id)
+VALUES (?, ?, ?, ?)
+'''
+# Un cobro de Telegram solo se registra una vez (se quitan antes los duplicados que ya hubiera,
+# conservando la primera fila de cada payment_id)
+_SQL_DUPLICATE_PAYMENTS = '''
+SELECT id, payment_id FROM purchases
+WHERE payment_id IS NOT NULL
+  AND id NOT IN (SELECT MIN(id) FROM purchases WHERE payment_id IS NOT NULL GROUP BY payment_id)
+'''
+_SQL_DELETE_PURCHASE = '''
+DELETE FROM purchases WHERE id = ?
+'''
+_SQL_UNIQUE_PAYMENT = '''
+CREATE UNIQUE INDEX IF NOT EXISTS idx_purchases_payment
+ON purchases (payment_id)
+'''
+_SQL_GET_CONTENT_BY_ID = '''
+SELECT id, title, description, media_type, media_file_id, price_stars
+FROM content 
+WHERE id = ? AND is_active = 1
+'''
+_SQL_GET_ANY_CONTENT_BY_ID = '''
+SELECT id, title, description, media_type, media_file_id, price_stars, is_active
+FROM content
+WHERE id = ?
+'''
+_SQL_STATS_TOTALS = '''
+SELECT
+    (SELECT COUNT(*) FROM users WHERE is_active = 1) AS total_users,
+    (SELECT COUNT(*) FROM content WHERE is_active = 1) AS total_content,
+    (SELECT COUNT(*) FROM purchases) AS total_sales,
+    (SELECT COALESCE(SUM(stars_paid), 0) FROM purchases) AS total_stars
+'''
+_SQL_TOP_CONTENT = '''
+SELECT c.title, COUNT(p.id) AS sales_count
+FROM content c
+LEFT JOIN purchases p ON c.id = p.content_id
+WHERE c.is_active = 1
+GROUP BY c.id, c.title
+ORDER BY sales_count DESC
+LIMIT 5
+'''
+_SQL_INSERT_CONTENT = '''
+INSERT INTO content (title, description, media_type, media_file_id, price_stars)
+VALUES (?, ?, ?, ?, ?)
+RETURNING id
+'''
+SQL_STATEMENT_CACHE_SIZE = 256
+READ_POOL_SIZE = 4  # conexiones de solo lectura junto a la de escritura
 
 # Variables globales para media groups
 media_groups = defaultdict(list)
 pending_groups = {}
 
+# Teclados del catálogo ya construidos: (es_admin, comprados) -> (versión, markup)
+catalog_markup_cache: Dict[tuple, tuple] = {}
+
+# Piezas de envío de cada publicación: (versión, id de contenido) -> piezas
+content_parts_cache: Dict[tuple, Dict] = {}
+
+@dataclass(slots=True)
+class PendingMedia:
+    """Archivo individual que el admin está configurando antes de publicarlo"""
+    type: str
+    file_id: str
+    filename: str = ''
+    description: str = ''
+    price: int = 0
+
 # Mensajes del bot en español
 MESSAGES = {
         # Mensajes principales
         'channel_empty': '💭 Este canal aún no tiene contenido publicado.',
+        'catalog_empty': (
+            '📭 Aún no hay contenido disponible.\n\n'
+            '¡Mantente atento! Pronto habrá contenido nuevo.'
+        ),
+        'catalog_title': '📺 **Catálogo de Contenido**\n\nSelecciona el contenido que deseas ver:',
         'content_unlocked': '✅ ¡Contenido desbloqueado!',
         'purchase_successful': '🎉 **¡Compra exitosa!**\n\nGracias por tu compra. El contenido ha sido desbloqueado.',
         'insufficient_stars': '❌ No tienes suficientes estrellas para esta compra.',
@@ -58,6 +335,53 @@ MESSAGES = {
         
         # Panel de administración
         'admin_panel': '🔧 **Panel de Administración**\n\nSelecciona una opción:',
+        'admin_menu': (
+            '📋 **MENÚ DE ADMINISTRADOR**\n\n'
+            '**Comandos Disponibles:**\n'
+            '• `/admin` - Panel principal\n'
+            '• `/menu` - Este menú\n'
+            '• `/start` - Ver como usuario\n'
+            '• `/ayuda` - Ayuda del bot\n'
+            '• `/catalogo` - Ver catálogo\n\n'
+            '**Acceso Rápido:**'
+        ),
+        'admin_add_content': (
+            '➕ **Añadir Contenido**\n\n'
+            'Para añadir contenido, envía el archivo (foto, video o documento) '
+            'seguido del comando:\n\n'
+            '`/add_content Título|Descripción|Precio_en_estrellas`\n\n'
+            'Ejemplo:\n'
+            '`/add_content Mi Video Premium|Video exclusivo de alta calidad|50`'
+        ),
+        'quick_upload': (
+            '➕ **Subir Contenido Rápido**\n\n'
+            '**Método Simplificado:**\n'
+            '1. Envía tu archivo (foto, video o documento)\n'
+            '2. Aparecerán botones automáticamente\n'
+            '3. Configura título, descripción y precio\n'
+            '4. ¡Listo para publicar!\n\n'
+            '**Método Tradicional:**\n'
+            'Usa: `/add_content Título|Descripción|Precio`'
+        ),
+        # Plantillas de estadísticas (se rellenan con format_map sobre get_stats)
+        'stats': (
+            '📊 **Estadísticas del Bot**\n\n'
+            '👥 **Usuarios registrados:** {total_users}\n'
+            '📁 **Contenido publicado:** {total_content}\n'
+            '💰 **Ventas realizadas:** {total_sales}\n'
+            '⭐ **Estrellas ganadas:** {total_stars}\n\n'
+            '🏆 **Top contenido:**\n'
+        ),
+        'stats_report': (
+            '📊 **Reporte Detallado**\n'
+            'Fecha: {date}\n\n'
+            '👥 Usuarios: {total_users}\n'
+            '📁 Contenido: {total_content}\n'
+            '💰 Ventas: {total_sales}\n'
+            '⭐ Estrellas: {total_stars}\n\n'
+            '🏆 **Top contenido:**\n'
+        ),
+        'stats_no_sales': 'Sin ventas aún',
         'content_published': '✅ **¡Contenido publicado!**',
         'content_sent_to_all': '📡 **Enviando a todos los usuarios...**',
         'upload_cancelled': '❌ **Subida cancelada**\n\nEl archivo no se ha publicado.',
@@ -109,25 +433,166 @@ def get_text(user_id: int, key: str) -> str:
     """Obtiene texto del diccionario de mensajes"""
     return MESSAGES.get(key, f"[Missing: {key}]")
 
+# Teclado del panel de administración (estático, se reutiliza en cada envío)
+ADMIN_PANEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Añadir Contenido", callback_data="admin_add_content")],
+    [InlineKeyboardButton("📋 Gestionar Contenido", callback_data="admin_manage_content")],
+    [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")],
+    [InlineKeyboardButton("⚙️ Configuración", callback_data="admin_settings")],
+    [InlineKeyboardButton("✏️ Mensaje de Ayuda", callback_data="admin_help_message")]
+])
+
+# Teclado del comando de menú de administrador
+ADMIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔧 Panel Admin", callback_data="quick_admin")],
+    [InlineKeyboardButton("➕ Subir Contenido", callback_data="quick_upload"), 
+     InlineKeyboardButton("📋 Gestionar", callback_data="admin_manage_content")],
+    [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")]
+])
+
+# Opciones de configuración
+ADMIN_SETTINGS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🗑️ Limpiar chats de usuarios", callback_data="clean_user_chats")],
+    [InlineKeyboardButton("⬅️ Volver", callback_data="admin_back")]
+])
+
+# Opciones del mensaje de ayuda
+HELP_MESSAGE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✏️ Cambiar Mensaje", callback_data="change_help_message")],
+    [InlineKeyboardButton("👀 Vista Previa", callback_data="preview_help_message")],
+    [InlineKeyboardButton("🔄 Restaurar Original", callback_data="reset_help_message")],
+    [InlineKeyboardButton("⬅️ Volver", callback_data="admin_back")]
+])
+
+# Precios para contenido individual
+PRICE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Gratuito (0 ⭐)", callback_data="price_0")],
+    [InlineKeyboardButton("5 ⭐", callback_data="price_5"), InlineKeyboardButton("10 ⭐", callback_data="price_10")],
+    [InlineKeyboardButton("25 ⭐", callback_data="price_25"), InlineKeyboardButton("50 ⭐", callback_data="price_50")],
+    [InlineKeyboardButton("100 ⭐", callback_data="price_100"), InlineKeyboardButton("200 ⭐", callback_data="price_200")],
+    [InlineKeyboardButton("✏️ Precio personalizado", callback_data="price_custom")],
+    [InlineKeyboardButton("⬅️ Volver", callback_data="back_to_setup")]
+])
+
+# Precios para grupos de archivos
+GROUP_PRICE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Gratuito (0 ⭐)", callback_data="group_price_0")],
+    [InlineKeyboardButton("5 ⭐", callback_data="group_price_5"), InlineKeyboardButton("10 ⭐", callback_data="group_price_10")],
+    [InlineKeyboardButton("25 ⭐", callback_data="group_price_25"), InlineKeyboardButton("50 ⭐", callback_data="group_price_50")],
+    [InlineKeyboardButton("100 ⭐", callback_data="group_price_100"), InlineKeyboardButton("200 ⭐", callback_data="group_price_200")],
+    [InlineKeyboardButton("✏️ Precio personalizado", callback_data="group_price_custom")],
+    [InlineKeyboardButton("⬅️ Volver", callback_data="back_to_group_setup")]
+])
+
+# Precios para toda la cola
+BATCH_PRICE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🆓 Gratis", callback_data="batch_price_0")],
+    [InlineKeyboardButton("⭐ 5 estrellas", callback_data="batch_price_5"),
+     InlineKeyboardButton("⭐ 10 estrellas", callback_data="batch_price_10")],
+    [InlineKeyboardButton("⭐ 25 estrellas", callback_data="batch_price_25"),
+     InlineKeyboardButton("⭐ 50 estrellas", callback_data="batch_price_50")],
+    [InlineKeyboardButton("⭐ 100 estrellas", callback_data="batch_price_100"),
+     InlineKeyboardButton("⭐ 200 estrellas", callback_data="batch_price_200")],
+    [InlineKeyboardButton("💰 Precio Personalizado", callback_data="batch_custom_price")],
+    [InlineKeyboardButton("⬅️ Volver", callback_data="batch_setup")]
+])
+
+# Gestión de la cola de archivos
+MEDIA_QUEUE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⚙️ Configurar Todo", callback_data="batch_setup")],
+    [InlineKeyboardButton("✅ Publicar Todo", callback_data="publish_all")],
+    [InlineKeyboardButton("🔄 Actualizar", callback_data="view_queue")],
+    [InlineKeyboardButton("🗑️ Limpiar Cola", callback_data="clear_queue")]
+])
+
+# Configuración masiva de la cola
+BATCH_SETUP_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✏️ Establecer Título General", callback_data="batch_title")],
+    [InlineKeyboardButton("📝 Establecer Descripción General", callback_data="batch_description")],
+    [InlineKeyboardButton("💰 Establecer Precio General", callback_data="batch_price")],
+    [InlineKeyboardButton("🔄 Configurar Individual", callback_data="individual_setup")],
+    [InlineKeyboardButton("⬅️ Volver a Cola", callback_data="view_queue")]
+])
+
+# Configuración de una publicación (vista previa inicial)
+SETUP_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_description")],
+    [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_price")],
+    [InlineKeyboardButton("✅ Publicar Contenido", callback_data="publish_content")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Configuración de una publicación tras establecer la descripción
+SETUP_DESCRIPTION_SET_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Cambiar Descripción", callback_data="setup_description")],
+    [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_price")],
+    [InlineKeyboardButton("✅ Publicar Contenido", callback_data="publish_content")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Configuración de una publicación tras establecer el precio
+SETUP_PRICE_SET_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✏️ Establecer Título", callback_data="setup_title")],
+    [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_description")],
+    [InlineKeyboardButton("💰 Cambiar Precio", callback_data="setup_price")],
+    [InlineKeyboardButton("✅ Publicar Contenido", callback_data="publish_content")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Configuración de un archivo individual de la cola
+SINGLE_FILE_SETUP_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_description")],
+    [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_price")],
+    [InlineKeyboardButton("✅ Publicar Archivo", callback_data="publish_content")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Configuración de un grupo recién subido
+GROUP_SETUP_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Descripción del Grupo", callback_data="setup_group_description")],
+    [InlineKeyboardButton("💰 Precio del Grupo", callback_data="setup_group_price")],
+    [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Configuración de un grupo tras establecer la descripción
+GROUP_SETUP_DESCRIPTION_SET_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Cambiar Descripción", callback_data="setup_group_description")],
+    [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_group_price")],
+    [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Configuración de un grupo tras establecer el precio
+GROUP_SETUP_PRICE_SET_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_group_description")],
+    [InlineKeyboardButton("💰 Cambiar Precio", callback_data="setup_group_price")],
+    [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
+    [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
+])
+
+# Botón de vuelta al panel
+BACK_TO_ADMIN_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Volver", callback_data="admin_back")]])
+
+# Botón de vuelta al mensaje de ayuda
+BACK_TO_HELP_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Volver", callback_data="admin_help_message")]])
+
+# Caracteres especiales que causan problemas de parseo: se eliminan en una sola pasada
+_MARKDOWN_STRIP_TABLE = str.maketrans('', '', '[]`>\\|{}!~#+')
+_MULTIPLE_ASTERISKS = re.compile(r'\*{3,}')
+_MULTIPLE_UNDERSCORES = re.compile(r'_{3,}')
+
 def escape_markdown(text: str) -> str:
     """Escapa caracteres especiales problemáticos de Markdown"""
     if not text:
         return ""
     
-    # Convertir a string si no lo es
-    text = str(text)
-    
-    # Remover caracteres especiales que causan problemas de parseo
-    # Mantener texto limpio y simple para evitar errores
-    problematic_chars = ['[', ']', '`', '>', '\\', '|', '{', '}', '!', '~', '#', '+']
-    
-    for char in problematic_chars:
-        text = text.replace(char, '')
+    # Convertir a string si no lo es y mantener texto limpio y simple para evitar errores
+    text = str(text).translate(_MARKDOWN_STRIP_TABLE)
     
     # Limpiar múltiples asteriscos o guiones bajos problemáticos
-    import re
-    text = re.sub(r'\*{3,}', '**', text)  # Reducir múltiples asteriscos
-    text = re.sub(r'_{3,}', '__', text)   # Reducir múltiples guiones bajos
+    text = _MULTIPLE_ASTERISKS.sub('**', text)  # Reducir múltiples asteriscos
+    text = _MULTIPLE_UNDERSCORES.sub('__', text)   # Reducir múltiples guiones bajos
     
     return text.strip()
 
@@ -145,165 +610,278 @@ def get_content_description(content: dict, user_language: str = 'es') -> str:
 
 class ContentBot:
     def __init__(self):
+        # Conexión única y persistente: conserva la caché de páginas de SQLite
+        # y evita abrir/cerrar el archivo en cada consulta
+        self._conn = self._connect(DATABASE_NAME)
+        self._lock = threading.RLock()
+        # Caché de get_content_list: incluye_inactivos -> (expira_en, lista)
+        self._content_list_cache: Dict[bool, tuple] = {}
+        # Caché de get_content_by_id: content_id -> contenido (o None si no existe)
+        self._content_cache: Dict[int, Optional[Dict]] = {}
+        self._content_generation = 0  # aumenta con cada invalidación
+        # LRU de usuarios ya registrados: user_id -> (username, first_name, last_name)
+        self._known_users: OrderedDict = OrderedDict()
+        # LRU de compras por usuario: user_id -> {content_id}; se carga al primer uso
+        self._purchases: OrderedDict = OrderedDict()
+        # Compras cobradas aún sin confirmar en la base de datos: user_id -> {content_id}.
+        # Dan acceso aunque la escritura falle y se quitan al confirmarse
+        self._unsaved_purchases: Dict[int, set] = defaultdict(set)
+        # Caché de get_stats: (expira_en, estadísticas); su propio lock evita
+        # que varias pulsaciones a la vez repitan la misma agregación
+        self._stats_cache: Optional[tuple] = None
+        self._stats_lock = threading.Lock()
         self.init_database()
+        # Lecturas en conexiones propias de solo lectura: con WAL no esperan a la escritura
+        self._readers: queue.Queue = queue.Queue()
+        for _ in range(READ_POOL_SIZE):
+            self._readers.put(self._connect_reader())
+        atexit.register(self.close)
     
     def init_database(self):
         """Inicializa la base de datos SQLite"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        # Tabla de contenido
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            media_type TEXT,
-            media_file_id TEXT,
-            price_stars INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT 1
-        )
-        ''')
-        
-        # Tabla de usuarios
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT 1
-        )
-        ''')
+        with self._lock:
+            # Tamaño de página y vacuum incremental: solo tienen efecto en bases nuevas
+            # (antes de activar WAL y crear tablas)
+            self._conn.execute(f'PRAGMA page_size={SQLITE_PAGE_SIZE}')
+            self._conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            # WAL + synchronous=NORMAL: las lecturas no bloquean a las escrituras
+            # y cada commit evita los fsync del journal por defecto
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA temp_store=MEMORY')
+            # Caché de páginas suficiente para tener el catálogo y sus índices en memoria
+            self._conn.execute('PRAGMA cache_size=-40000')  # ~40 MB
+            new_index_tables = self._create_tables()
+            # Estadísticas para el planificador (solo analiza lo que lo necesita)
+            self._conn.execute('PRAGMA analysis_limit=1000')
+            if not self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            ).fetchone():
+                # Base nunca analizada: optimize no tendría estadísticas previas que refrescar
+                self._conn.execute('ANALYZE')
+            else:
+                # Índices recién creados: sin estadísticas el planificador no sabe cuándo usarlos
+                for table in sorted(new_index_tables):
+                    self._conn.execute(f'ANALYZE "{table}"')
+            self._conn.execute('PRAGMA optimize')
         
-        # Tabla de compras
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS purchases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            content_id INTEGER,
-            stars_paid INTEGER,
-            payment_id TEXT,
-            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id),
-            FOREIGN KEY (content_id) REFERENCES content (id)
-        )
-        ''')
+        # Limpiar contenido con file IDs inválidos al inicializar
+        deleted_count = self.clean_invalid_content()
+        if deleted_count > 0:
+            logger.info(f"Limpieza completada: {deleted_count} contenido(s) inválido(s) eliminado(s)")
         
-        # Tabla de configuraciones
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        logger.info("Base de datos inicializada correctamente")
+
+    def optimize(self):
+        """Refresca las estadísticas del planificador que hayan quedado desfasadas"""
+        with self._lock:
+            self._conn.execute('PRAGMA optimize')
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """Libera hasta `pages` páginas libres del archivo; devuelve cuántas quedan"""
+        with self._lock:
+            if self._conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                # Base creada sin auto_vacuum=INCREMENTAL: el pragma no haría nada
+                return 0
+            # incremental_vacuum libera una página por paso y execute() solo da el primero;
+            # executescript ejecuta la sentencia hasta el final
+            self._conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+            return self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    @staticmethod
+    def _connect(database: str, **kwargs) -> sqlite3.Connection:
+        """Abre una conexión con los ajustes comunes a escritura y lecturas"""
+        conn = sqlite3.connect(
+            database,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=SQL_STATEMENT_CACHE_SIZE,
+            **kwargs
         )
-        ''')
-        
-        # Insertar mensaje de ayuda predeterminado si no existe
-        cursor.execute('''
-        INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)
-        ''', ('help_message', '''📋 **Comandos Disponibles:**
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA mmap_size=268435456')  # 256 MB
+        # Si otra conexión tiene el bloqueo de escritura, esperar en lugar de fallar
+        conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        return conn
 
-🎬 *Para usuarios:*
-/start - Mensaje de bienvenida
-/catalogo - Ver contenido disponible
-/ayuda - Esta ayuda
+    def _connect_reader(self) -> sqlite3.Connection:
+        """Abre una conexión de solo lectura para el pool de lecturas"""
+        conn = self._connect(f'file:{quote(DATABASE_NAME)}?mode=ro', uri=True)
+        conn.execute('PRAGMA query_only=ON')
+        return conn
 
-💫 *Sobre las estrellas:*
-• Las estrellas ⭐ son la moneda oficial de Telegram
-• Se compran directamente en Telegram
-• Permiten acceder a contenido premium
+    @contextlib.contextmanager
+    def _reader(self):
+        """Presta una conexión de solo lectura del pool"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
 
-❓ *¿Necesitas ayuda?*
-Si tienes problemas, contacta al administrador del canal.'''))
-        
-        conn.commit()
-        conn.close()
+    def close(self):
+        """Guarda las estadísticas del planificador y cierra la conexión"""
+        atexit.unregister(self.close)
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        with self._lock:
+            try:
+                self._conn.execute('PRAGMA optimize')
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo optimizar la base de datos al cerrar: {e}")
+            self._conn.close()
+
+    def _create_tables(self) -> set:
+        """Crea las tablas si no existen y devuelve las tablas que han ganado índices nuevos"""
+        cursor = self._conn.cursor()
+        index_query = "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'"
+        indexes = set(cursor.execute(index_query))
+        
+        cursor.executescript(_SQL_SCHEMA)
+        
+        if not cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_purchases_payment'"
+        ).fetchone():
+            # Borrado e índice en una transacción: si el índice falla no se pierde ninguna fila
+            with self._transaction():
+                duplicates = self._conn.execute(_SQL_DUPLICATE_PAYMENTS).fetchall()
+                if duplicates:
+                    logger.warning(
+                        f"Eliminando {len(duplicates)} compra(s) con payment_id repetido: "
+                        f"{sorted({row['payment_id'] for row in duplicates})}"
+                    )
+                    self._conn.executemany(_SQL_DELETE_PURCHASE, [(row['id'],) for row in duplicates])
+                self._conn.execute(_SQL_UNIQUE_PAYMENT)
         
-        # Limpiar contenido con file IDs inválidos al inicializar
-        deleted_count = self.clean_invalid_content()
-        if deleted_count > 0:
-            logger.info(f"Limpieza completada: {deleted_count} contenido(s) inválido(s) eliminado(s)")
+        # Insertar mensaje de ayuda predeterminado si no existe
+        cursor.execute('''
+        INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)
+        ''', ('help_message', MESSAGES['help_message']))
         
-        logger.info("Base de datos inicializada correctamente")
+        return {table for _, table in set(cursor.execute(index_query)) - indexes}
 
-    def is_admin(self, user_id: int) -> bool:
+    @staticmethod
+    def is_admin(user_id: int) -> bool:
         """Verifica si el usuario es administrador"""
-        return user_id == ADMIN_USER_ID
+        return user_id in ADMIN_USER_IDS
 
     def register_user(self, user_id: int, username: Optional[str] = None, 
                      first_name: Optional[str] = None, last_name: Optional[str] = None):
         """Registra un nuevo usuario"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
+        self.register_users([(user_id, username, first_name, last_name)])
+
+    def register_users(self, users: List[tuple]):
+        """Registra un lote de usuarios (user_id, username, first_name, last_name) en una transacción"""
+        pending = {}
+        with self._lock:
+            for user_id, username, first_name, last_name in users:
+                profile = (username or '', first_name or '', last_name or '')
+                # Usuario ya visto con los mismos datos: no hace falta tocar la base de datos
+                if self._known_users.get(user_id) == profile:
+                    self._known_users.move_to_end(user_id)
+                else:
+                    pending[user_id] = profile
         
-        cursor.execute('''
-        INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
-        VALUES (?, ?, ?, ?)
-        ''', (user_id, username or '', first_name or '', last_name or ''))
+        if not pending:
+            return
         
-        conn.commit()
-        conn.close()
-    
+        with self._transaction():
+            self._conn.executemany(
+                _SQL_REGISTER_USER, [(user_id, *profile) for user_id, profile in pending.items()]
+            )
+            for user_id, profile in pending.items():
+                self._known_users[user_id] = profile
+                self._known_users.move_to_end(user_id)
+            while len(self._known_users) > KNOWN_USERS_CACHE_SIZE:
+                self._known_users.popitem(last=False)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Transacción de escritura: BEGIN IMMEDIATE toma el bloqueo al empezar, no a mitad"""
+        with self._lock:
+            generation = self._content_generation
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            # El pool de lectura pudo cachear la versión anterior antes del COMMIT
+            if generation != self._content_generation:
+                self._invalidate_content_cache()
+
+    @property
+    def catalog_version(self) -> int:
+        """Versión del catálogo: cambia con cada escritura en la tabla content"""
+        return self._content_generation
+
+    async def run(self, fn, *args):
+        """Ejecuta un método de la base de datos en un hilo para no bloquear el event loop"""
+        return await asyncio.to_thread(fn, *args)
+
+    def _invalidate_content_cache(self):
+        """Descarta el contenido cacheado tras cualquier escritura en la tabla content"""
+        self._content_generation += 1
+        self._content_list_cache.clear()
+        self._content_cache.clear()
+        self._stats_cache = None
 
     def get_content_list(self, user_id: Optional[int] = None) -> List[Dict]:
         """Obtiene la lista de contenido disponible"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
+        include_inactive = not (user_id and not self.is_admin(user_id))
+        cached = self._content_list_cache.get(include_inactive)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        generation = self._content_generation
+        with self._reader() as conn:
+            # Mismas columnas para todos; is_active solo se muestra en vistas de admin
+            cursor = conn.execute(_SQL_CONTENT_LIST[include_inactive])
+            
+            # Una sola pasada sobre el cursor; la descripción de media_group se limpia al copiar la fila
+            content = [
+                dict(row, description=self.clean_description(row['description'], row['media_type']))
+                for row in cursor
+            ]
         
-        if user_id and not self.is_admin(user_id):
-            # Solo contenido activo para usuarios normales
-            cursor.execute('''
-            SELECT id, title, description, media_type, media_file_id, price_stars
-            FROM content 
-            WHERE is_active = 1
-            ORDER BY created_at ASC
-            ''')
-        else:
-            # Todo el contenido para admin
-            cursor.execute('''
-            SELECT id, title, description, media_type, media_file_id, price_stars, is_active
-            FROM content 
-            ORDER BY created_at ASC
-            ''')
-        
-        content = []
-        for row in cursor.fetchall():
-            # Extraer descripción limpia para media_group
-            description = row[2]
-            if row[3] == 'media_group':  # media_type es media_group
-                import json
-                try:
-                    group_info = json.loads(row[2])
-                    description = group_info.get('description', '')
-                except (json.JSONDecodeError, TypeError):
-                    description = str(row[2])
-            
-            if user_id and not self.is_admin(user_id):
-                content.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'description': description,  # Descripción limpia
-                    'media_type': row[3],
-                    'media_file_id': row[4],
-                    'price_stars': row[5]
-                })
-            else:
-                content.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'description': description,  # Descripción limpia
-                    'media_type': row[3],
-                    'media_file_id': row[4],
-                    'price_stars': row[5],
-                    'is_active': row[6]
-                })
-        
-        conn.close()
+        # No cachear si hubo una escritura mientras se construía la lista
+        with self._lock:
+            if generation == self._content_generation:
+                self._content_list_cache[include_inactive] = (time.monotonic() + CONTENT_LIST_TTL, content)
         return content
 
+    def get_content_page(self, user_id: Optional[int], offset: int, limit: int) -> Tuple[List[Dict], int]:
+        """Obtiene una página del contenido disponible y el total"""
+        include_inactive = not (user_id and not self.is_admin(user_id))
+        cached = self._content_list_cache.get(include_inactive)
+        if cached and cached[0] > time.monotonic():
+            return cached[1][offset:offset + limit], len(cached[1])
+        
+        # Sin lista en caché: leer solo la página pedida en lugar de todo el catálogo
+        with self._reader() as conn:
+            total = conn.execute(_SQL_CONTENT_COUNT[include_inactive]).fetchone()[0]
+            cursor = conn.execute(_SQL_CONTENT_PAGE[include_inactive], (limit, offset))
+            content = [
+                dict(row, description=self.clean_description(row['description'], row['media_type']))
+                for row in cursor
+            ]
+        return content, total
+
+    def clean_description(self, description: str, media_type: str) -> str:
+        """Devuelve la descripción visible (los media_group guardan JSON)"""
+        if media_type != 'media_group':
+            return description
+        
+        try:
+            group_info = json_loads(description)
+        except (ValueError, TypeError):
+            return str(description)
+        # Solo el JSON de un media_group es un objeto; cualquier otro texto ya es la descripción
+        if not isinstance(group_info, dict):
+            return str(description)
+        return group_info.get('description', '')
+
     def add_content(self, title: str, description: str, media_type: str, 
                    media_file_id: str, price_stars: int = 0) -> Optional[int]:
         """Añade nuevo contenido y devuelve el ID"""
@@ -312,63 +890,124 @@ Si tienes problemas, contacta al administrador del canal.'''))
             logger.error(f"File ID inválido rechazado: '{media_file_id}'")
             return None
         
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-            INSERT INTO content (title, description, media_type, media_file_id, price_stars)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (title, description, media_type, media_file_id, price_stars))
-            
-            content_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self._transaction():
+                # RETURNING devuelve el ID en la misma sentencia
+                content_id = self._conn.execute(
+                    _SQL_INSERT_CONTENT, (title, description, media_type, media_file_id, price_stars)
+                ).fetchone()[0]
+                self._invalidate_content_cache()
             logger.info(f"Contenido añadido exitosamente: ID {content_id}, file_id: {media_file_id[:20]}...")
             return content_id
         except Exception as e:
             logger.error(f"Error añadiendo contenido: {e}")
-            conn.close()
             return None
 
+    def add_content_bulk(self, rows: List[tuple]) -> List[Optional[int]]:
+        """Añade varios contenidos (title, description, media_type, media_file_id, price_stars) en una transacción"""
+        content_ids: List[Optional[int]] = [None] * len(rows)
+        try:
+            with self._transaction():
+                for i, row in enumerate(rows):
+                    if not self.validate_file_id(row[3]):
+                        logger.error(f"File ID inválido rechazado: '{row[3]}'")
+                        continue
+                    # Misma sentencia en cada fila: se prepara una vez gracias a la caché de sentencias
+                    content_ids[i] = self._conn.execute(_SQL_INSERT_CONTENT, row).fetchone()[0]
+                self._invalidate_content_cache()
+            logger.info(f"Contenido añadido en lote: {sum(1 for c in content_ids if c)} de {len(rows)}")
+            return content_ids
+        except Exception as e:
+            logger.error(f"Error añadiendo contenido en lote: {e}")
+            return [None] * len(rows)
+
+    def purchased_set(self, user_id: int) -> set:
+        """Devuelve los IDs de contenido comprados por el usuario (no modificar el conjunto)"""
+        # Bajo el bloqueo de escritura: una compra no puede confirmarse entre la lectura y el guardado
+        with self._lock:
+            owned = self._purchases.get(user_id)
+            if owned is not None:
+                self._purchases.move_to_end(user_id)
+            else:
+                with self._reader() as conn:
+                    owned = {row[0] for row in conn.execute(_SQL_USER_PURCHASES, (user_id,))}
+                self._purchases[user_id] = owned
+                if len(self._purchases) > PURCHASE_CACHE_SIZE:
+                    self._purchases.popitem(last=False)
+            
+            unsaved = self._unsaved_purchases.get(user_id)
+            return owned | unsaved if unsaved else owned
+    
     def has_purchased_content(self, user_id: int, content_id: int) -> bool:
         """Verifica si el usuario ha comprado el contenido"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT COUNT(*) FROM purchases 
-        WHERE user_id = ? AND content_id = ?
-        ''', (user_id, content_id))
+        return content_id in self.purchased_set(user_id)
+    
+    def purchased_ids(self, user_id: int, content_ids: List[int]) -> set:
+        """Devuelve cuáles de los contenidos dados ha comprado el usuario"""
+        return self.purchased_set(user_id).intersection(content_ids)
+    
+    def buyers_of(self, content_id: int) -> set:
+        """Devuelve los IDs de usuario que ya compraron el contenido (una sola consulta por difusión)"""
+        with self._reader() as conn:
+            return {row[0] for row in conn.execute(_SQL_CONTENT_BUYERS, (content_id,))}
+    
+    def get_content_and_access(self, content_id: int, user_id: int) -> Optional[Dict]:
+        """Obtiene un contenido (activo o no) y si el usuario ya lo compró"""
+        with self._reader() as conn:
+            row = conn.execute(_SQL_GET_ANY_CONTENT_BY_ID, (content_id,)).fetchone()
         
-        result = cursor.fetchone()[0] > 0
-        conn.close()
-        return result
+        if not row:
+            return None
+        return dict(
+            row,
+            description=self.clean_description(row['description'], row['media_type']),
+            purchased=self.has_purchased_content(user_id, content_id)
+        )
+    
+    def grant_purchases(self, purchases: List[tuple]):
+        """Da acceso en memoria a compras ya cobradas antes de guardarlas"""
+        with self._lock:
+            for user_id, content_id, _, _ in purchases:
+                self._unsaved_purchases[user_id].add(content_id)
+    
+    def record_purchases(self, purchases: List[tuple]):
+        """Registra un lote de compras (user_id, content_id, stars_paid, payment_id) en una transacción"""
+        with self._lock:
+            with self._transaction():
+                cursor = self._conn.executemany(_SQL_INSERT_PURCHASE, purchases)
+            if cursor.rowcount < len(purchases):
+                # Reintentos de Telegram con el mismo cobro: ya estaban registrados
+                logger.info(f"{len(purchases) - cursor.rowcount} compra(s) repetida(s) ignorada(s)")
+            # Solo tras el commit: si la transacción falla no se da acceso.
+            # Los usuarios que no están en memoria leerán la compra al cargarse
+            self._stats_cache = None
+            for user_id, content_id, _, _ in purchases:
+                owned = self._purchases.get(user_id)
+                if owned is not None:
+                    owned.add(content_id)
+                unsaved = self._unsaved_purchases.get(user_id)
+                if unsaved is not None:
+                    unsaved.discard(content_id)
+                    if not unsaved:
+                        del self._unsaved_purchases[user_id]
     
     def get_setting(self, key: str, default_value: str = "") -> str:
         """Obtiene una configuración de la base de datos"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
+        with self._reader() as conn:
+            cursor = conn.execute('SELECT value FROM settings WHERE key = ?', (key,))
+            result = cursor.fetchone()
         
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-        result = cursor.fetchone()
-        
-        conn.close()
         return result[0] if result else default_value
     
     def set_setting(self, key: str, value: str) -> bool:
         """Guarda una configuración en la base de datos"""
         try:
-            conn = sqlite3.connect(DATABASE_NAME)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            INSERT OR REPLACE INTO settings (key, value, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-            ''', (key, value))
+            with self._transaction():
+                self._conn.execute('''
+                INSERT OR REPLACE INTO settings (key, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (key, value))
             
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             logger.error(f"Error al guardar configuración: {e}")
@@ -376,127 +1015,110 @@ Si tienes problemas, contacta al administrador del canal.'''))
 
     def get_content_by_id(self, content_id: int) -> Optional[Dict]:
         """Obtiene contenido por ID"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT id, title, description, description_en, description_fr, description_pt, 
-               description_it, description_de, description_ru, description_hi, 
-               description_ar, media_type, media_file_id, price_stars
-        FROM content 
-        WHERE id = ? AND is_active = 1
-        ''', (content_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'description_en': row[3],
-                'description_fr': row[4],
-                'description_pt': row[5],
-                'description_it': row[6],
-                'description_de': row[7],
-                'description_ru': row[8],
-                'description_hi': row[9],
-                'description_ar': row[10],
-                'media_type': row[11],
-                'media_file_id': row[12],
-                'price_stars': row[13]
-            }
-        return None
+        try:
+            return self._content_cache[content_id]
+        except KeyError:
+            pass
+        
+        generation = self._content_generation
+        with self._reader() as conn:
+            cursor = conn.execute(_SQL_GET_CONTENT_BY_ID, (content_id,))
+            
+            row = cursor.fetchone()
+        
+        # Descripción ya limpia, igual que en la lista: quien la reciba no la vuelve a procesar
+        content = dict(
+            row, description=self.clean_description(row['description'], row['media_type'])
+        ) if row else None
+        # Igual que la lista: no cachear si hubo una escritura durante la lectura
+        with self._lock:
+            if generation == self._content_generation:
+                if len(self._content_cache) >= CONTENT_CACHE_SIZE:
+                    self._content_cache.clear()
+                self._content_cache[content_id] = content
+        return content
     
     def delete_content(self, content_id: int) -> bool:
         """Elimina contenido permanentemente de la base de datos"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
         try:
-            # Eliminar de la tabla content
-            cursor.execute('DELETE FROM content WHERE id = ?', (content_id,))
-            
-            # Eliminar compras relacionadas (opcional - mantener para historial)
-            # cursor.execute('DELETE FROM purchases WHERE content_id = ?', (content_id,))
-            
-            conn.commit()
-            rows_affected = cursor.rowcount
-            conn.close()
+            with self._transaction():
+                # Eliminar de la tabla content
+                cursor = self._conn.execute('DELETE FROM content WHERE id = ?', (content_id,))
+                
+                # Eliminar compras relacionadas (opcional - mantener para historial)
+                # self._conn.execute('DELETE FROM purchases WHERE content_id = ?', (content_id,))
+                
+                rows_affected = cursor.rowcount
+                self._invalidate_content_cache()
             
             return rows_affected > 0
         except Exception as e:
             logger.error(f"Error eliminando contenido {content_id}: {e}")
-            conn.close()
             return False
     
     def clean_invalid_content(self) -> int:
         """Limpia contenido con file IDs inválidos de la base de datos"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
         try:
-            # Primero, revisar TODO el contenido para diagnosticar
-            cursor.execute('SELECT id, title, media_file_id, media_type FROM content WHERE is_active = 1')
-            all_content = cursor.fetchall()
-            
-            logger.info(f"Diagnosticando {len(all_content)} contenido(s) existente(s):")
-            
-            invalid_content = []
-            for content_id, title, file_id, media_type in all_content:
-                logger.info(f"  - ID {content_id}: '{title}' tipo:{media_type} file_id: '{file_id[:30] if file_id else 'NULL'}{'...' if file_id and len(file_id) > 30 else ''}")
+            with self._transaction():
+                # Primero, revisar TODO el contenido para diagnosticar
+                cursor = self._conn.execute('SELECT id, title, media_file_id, media_type FROM content WHERE is_active = 1')
+                all_content = cursor.fetchall()
                 
-                # Validar file ID
-                if not self.validate_file_id(file_id):
-                    invalid_content.append((content_id, title, file_id))
-                    logger.warning(f"    \u2192 INVALID: ID {content_id}")
-            
-            if invalid_content:
-                # Eliminar contenido inválido
-                invalid_ids = [str(row[0]) for row in invalid_content]
-                placeholders = ','.join(['?' for _ in invalid_ids])
-                cursor.execute(f'DELETE FROM content WHERE id IN ({placeholders})', invalid_ids)
+                logger.info(f"Diagnosticando {len(all_content)} contenido(s) existente(s):")
                 
-                conn.commit()
-                deleted_count = len(invalid_content)
-                logger.info(f"\u2705 Eliminado {deleted_count} contenido(s) con file IDs inválidos")
+                invalid_content = []
+                for content_id, title, file_id, media_type in all_content:
+                    logger.info(f"  - ID {content_id}: '{title}' tipo:{media_type} file_id: '{file_id[:30] if file_id else 'NULL'}{'...' if file_id and len(file_id) > 30 else ''}")
+                    
+                    # Validar file ID
+                    if not self.validate_file_id(file_id):
+                        invalid_content.append((content_id, title, file_id))
+                        logger.warning(f"    \u2192 INVALID: ID {content_id}")
                 
-                for content_id, title, file_id in invalid_content:
-                    logger.info(f"  - Eliminado ID {content_id}: '{title}'")
+                if not invalid_content:
+                    logger.info("\u2705 Todos los file IDs son válidos")
+                    return 0
                 
-                conn.close()
-                return deleted_count
-            else:
-                conn.close()
-                logger.info("\u2705 Todos los file IDs son válidos")
-                return 0
+                # Eliminar contenido inválido
+                invalid_ids = [str(row[0]) for row in invalid_content]
+                placeholders = ','.join(['?' for _ in invalid_ids])
+                self._conn.execute(f'DELETE FROM content WHERE id IN ({placeholders})', invalid_ids)
+                self._invalidate_content_cache()
+            
+            deleted_count = len(invalid_content)
+            logger.info(f"\u2705 Eliminado {deleted_count} contenido(s) con file IDs inválidos")
+            
+            for content_id, title, file_id in invalid_content:
+                logger.info(f"  - Eliminado ID {content_id}: '{title}'")
+            
+            return deleted_count
                 
         except Exception as e:
             logger.error(f"Error limpiando contenido inválido: {e}")
-            conn.close()
             return 0
     
     def clear_all_content(self) -> int:
         """Elimina TODO el contenido existente (para empezar limpio)"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('SELECT COUNT(*) FROM content')
-            total_count = cursor.fetchone()[0]
+            with self._transaction():
+                total_count = self._conn.execute('SELECT COUNT(*) FROM content').fetchone()[0]
+                
+                if total_count > 0:
+                    # Ambos DELETE en la misma transacción
+                    self._conn.execute('DELETE FROM content')
+                    self._conn.execute('DELETE FROM purchases')  # Limpiar compras también
+                    self._invalidate_content_cache()
+                    logger.info(f"\u2705 Eliminado TODO el contenido existente: {total_count} elemento(s)")
             
             if total_count > 0:
-                cursor.execute('DELETE FROM content')
-                cursor.execute('DELETE FROM purchases')  # Limpiar compras también
-                conn.commit()
-                logger.info(f"\u2705 Eliminado TODO el contenido existente: {total_count} elemento(s)")
-            
-            conn.close()
+                with self._lock:
+                    self._purchases.clear()
+                    self._unsaved_purchases.clear()
+                # Las tablas han cambiado de tamaño por completo
+                self.optimize()
             return total_count
         except Exception as e:
             logger.error(f"Error eliminando todo el contenido: {e}")
-            conn.close()
             return 0
     
     def validate_file_id(self, file_id: str) -> bool:
@@ -517,325 +1139,404 @@ Si tienes problemas, contacta al administrador del canal.'''))
         
         return True
     
-    def get_all_users(self) -> List[int]:
-        """Obtiene lista de todos los usuarios registrados"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT user_id FROM users WHERE is_active = 1
-        ''')
-        
-        users = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return users
+    def get_user_batch(self, after_user_id: int, limit: int) -> List[int]:
+        """Obtiene el siguiente lote de usuarios activos con ID mayor que after_user_id"""
+        with self._reader() as conn:
+            return [row[0] for row in conn.execute(_SQL_USER_BATCH, (after_user_id, limit))]
     
     def get_stats(self) -> Dict[str, Any]:
         """Obtiene estadísticas del bot"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        # Total de usuarios
-        cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
-        total_users = cursor.fetchone()[0]
-        
-        # Total de contenido
-        cursor.execute('SELECT COUNT(*) FROM content WHERE is_active = 1')
-        total_content = cursor.fetchone()[0]
-        
-        # Total de ventas
-        cursor.execute('SELECT COUNT(*) FROM purchases')
-        total_sales = cursor.fetchone()[0]
-        
-        # Total de estrellas ganadas
-        cursor.execute('SELECT SUM(stars_paid) FROM purchases')
-        total_stars = cursor.fetchone()[0] or 0
-        
-        # Contenido más vendido
-        cursor.execute('''
-        SELECT c.title, COUNT(p.id) as sales_count
-        FROM content c
-        LEFT JOIN purchases p ON c.id = p.content_id
-        WHERE c.is_active = 1
-        GROUP BY c.id, c.title
-        ORDER BY sales_count DESC
-        LIMIT 5
-        ''')
-        top_content = cursor.fetchall()
-        
-        conn.close()
-        
-        return {
-            'total_users': total_users,
-            'total_content': total_content,
-            'total_sales': total_sales,
-            'total_stars': total_stars,
-            'top_content': top_content
-        }
+        with self._stats_lock:
+            cached = self._stats_cache
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            
+            with self._reader() as conn:
+                # Todos los totales en una sola consulta
+                stats = dict(conn.execute(_SQL_STATS_TOTALS).fetchone())
+                
+                # Contenido más vendido (idx_purchases_content evita recorrer todas las compras)
+                stats['top_content'] = conn.execute(_SQL_TOP_CONTENT).fetchall()
+            
+            self._stats_cache = (time.monotonic() + STATS_TTL, stats)
+            return stats
     
     def add_media_group_content(self, title: str, description: str, files: List[Dict], price_stars: int = 0) -> Optional[int]:
         """Añade contenido de grupo de medios y devuelve el ID"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
         try:
             # Para simplificar, guardaremos el primer archivo como referencia principal
             # En una implementación más compleja, podrías crear una tabla separada para grupos
             media_type = "media_group"  # Tipo especial para grupos
             
             # Serializar información de todos los archivos en el campo description
-            import json
             # Los archivos ya son diccionarios serializables
             group_info = {
                 'description': description,
                 'files': files,
                 'total_files': len(files)
             }
-            serialized_description = json.dumps(group_info, ensure_ascii=False)
+            serialized_description = json_dumps(group_info)
             
             # Usar el file_id del primer archivo
             main_file_id = files[0].get('file_id', '') if files else ''
             
-            cursor.execute('''
-            INSERT INTO content (title, description, media_type, media_file_id, price_stars)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (title, serialized_description, media_type, main_file_id, price_stars))
-            
-            content_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self._transaction():
+                content_id = self._conn.execute('''
+                INSERT INTO content (title, description, media_type, media_file_id, price_stars)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING id
+                ''', (title, serialized_description, media_type, main_file_id, price_stars)).fetchone()[0]
+                
+                self._invalidate_content_cache()
             return content_id
         except Exception as e:
             logger.error(f"Error añadiendo grupo de contenido: {e}")
-            conn.close()
             return None
     
     def get_media_group_by_id(self, content_id: int) -> Optional[Dict]:
         """Obtiene grupo de medios por ID"""
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT id, title, description, media_type, media_file_id, price_stars
-        FROM content 
-        WHERE id = ? AND is_active = 1 AND media_type = 'media_group'
-        ''', (content_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
+        with self._reader() as conn:
+            cursor = conn.execute('''
+            SELECT id, title, description, media_type, media_file_id, price_stars
+            FROM content 
+            WHERE id = ? AND is_active = 1 AND media_type = 'media_group'
+            ''', (content_id,))
+            
+            row = cursor.fetchone()
         
         if row:
-            import json
             try:
-                group_info = json.loads(row[2])  # description contiene la info serializada
+                group_info = json_loads(row['description'])  # description contiene la info serializada
                 return {
-                    'id': row[0],
-                    'title': row[1],
+                    'id': row['id'],
+                    'title': row['title'],
                     'description': group_info.get('description', ''),
-                    'media_type': row[3],
+                    'media_type': row['media_type'],
                     'files': group_info.get('files', []),
                     'total_files': group_info.get('total_files', 0),
-                    'price_stars': row[5]
+                    'price_stars': row['price_stars']
                 }
-            except json.JSONDecodeError:
+            except (ValueError, TypeError):
                 # Fallback si hay problema con el JSON
                 return {
-                    'id': row[0],
-                    'title': row[1],
-                    'description': row[2],
-                    'media_type': row[3],
+                    'id': row['id'],
+                    'title': row['title'],
+                    'description': row['description'],
+                    'media_type': row['media_type'],
                     'files': [],
-                    'price_stars': row[5]
+                    'price_stars': row['price_stars']
                 }
         return None
 
-async def update_all_user_chats(context: ContextTypes.DEFAULT_TYPE):
-    """Actualiza silenciosamente los chats de todos los usuarios enviando contenido actualizado"""
-    users = content_bot.get_all_users()
-    
-    for user_id in users:
+class TokenBucket:
+    """Limitador de ritmo: como mucho `rate` adquisiciones por segundo, con ráfagas de hasta `rate`"""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated: Optional[float] = None
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self, count: int = 1):
+        """Espera hasta que haya `count` fichas disponibles y las consume (se recorta a una ráfaga, `rate`)"""
+        count = min(count, self.rate)
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                await asyncio.sleep((count - self.tokens) / self.rate)
+
+# Un único limitador para todas las difusiones: el límite de Telegram es por bot.
+# Es None si está instalado AIORateLimiter, que ya marca el ritmo y reintenta los 429
+broadcast_bucket: Optional[TokenBucket] = TokenBucket(BROADCAST_RATE)
+
+async def send_with_retries(send_one, user_id: int) -> str:
+    """Ejecuta send_one(user_id) respetando los 429 de Telegram; devuelve su estado, 'blocked' o 'failed'"""
+    for attempt in range(BROADCAST_MAX_ATTEMPTS):
         try:
-            # Simular estructura para send_all_posts
-            class FakeUpdate:
-                def __init__(self, user_id):
-                    self.effective_chat = type('obj', (object,), {'id': user_id})
-                    self.effective_user = type('obj', (object,), {'id': user_id})
-                    self.message = None  # No hay mensaje original
-            
-            fake_update = FakeUpdate(user_id)
-            await send_all_posts(fake_update, context)
-            
-            # Pausa para evitar spam
-            import asyncio
-            await asyncio.sleep(0.2)
+            return await send_one(user_id)
+        except RetryAfter as e:
+            if broadcast_bucket is None:
+                # AIORateLimiter ya agotó sus reintentos: no se multiplican aquí
+                logger.error(f"Usuario {user_id} descartado por límite de envíos: {e}")
+                return 'failed'
+            # Telegram pide esperar: se respeta (con algo de margen) y se reintenta
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            await asyncio.sleep(retry_after + random.uniform(0, 1))
+        except Forbidden:
+            # El usuario bloqueó el bot: no tiene sentido reintentar
+            return 'blocked'
+        except BadRequest as e:
+            logger.error(f"Petición rechazada para usuario {user_id}: {e}")
+            return 'failed'
+        except NetworkError as e:
+            # Incluye TimedOut: espera exponencial antes de reintentar
+            logger.warning(f"Error de red con usuario {user_id} (intento {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
         except Exception as e:
-            logger.error(f"Error actualizando chat de usuario {user_id}: {e}")
+            logger.error(f"Error procesando usuario {user_id}: {e}")
+            return 'failed'
+    
+    logger.error(f"Usuario {user_id} descartado tras {BROADCAST_MAX_ATTEMPTS} intentos")
+    return 'failed'
+
+async def for_each_active_user(send_one, on_progress=None, messages_per_user: int = 1) -> Counter:
+    """Ejecuta send_one(user_id) para cada usuario activo con concurrencia y ritmo limitados"""
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    results = Counter()
+    
+    async def run_one(user_id: int):
+        try:
+            results[await send_with_retries(send_one, user_id)] += 1
+        finally:
+            semaphore.release()
+    
+    # Los usuarios llegan por lotes desde SQLite: solo hay en vuelo tantas
+    # tareas como huecos del semáforo y el primer envío sale sin esperar al resto
+    pending = set()
+    started = 0
+    async for user_id in iter_active_users():
+        await semaphore.acquire()
+        if broadcast_bucket is not None:
+            await broadcast_bucket.acquire(messages_per_user)
+        task = asyncio.create_task(run_one(user_id))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        
+        started += 1
+        if on_progress and started % BROADCAST_PROGRESS_EVERY == 0:
+            try:
+                await on_progress(results)
+            except Exception as e:
+                logger.warning(f"No se pudo actualizar el progreso: {e}")
+    
+    if pending:
+        await asyncio.gather(*pending)
+    return results
+
+async def iter_active_users():
+    """Recorre los usuarios activos por lotes sin cargarlos todos en memoria"""
+    # Paginación por clave: cada lote continúa tras el último ID visto
+    last_user_id = -1
+    while True:
+        batch = await content_bot.run(content_bot.get_user_batch, last_user_id, USER_BATCH_SIZE)
+        for user_id in batch:
+            yield user_id
+        if len(batch) < USER_BATCH_SIZE:
+            return
+        last_user_id = batch[-1]
 
 async def broadcast_new_content(context: ContextTypes.DEFAULT_TYPE, content_id: int):
     """Envía nuevo contenido a todos los usuarios registrados"""
-    users = content_bot.get_all_users()
-    content = content_bot.get_content_by_id(content_id)
+    content = await content_bot.run(content_bot.get_content_by_id, content_id)
     
     if not content:
         return
     
-    logger.info(f"📢 Enviando contenido ID {content_id} '{content.get('title', '')}' a {len(users)} usuarios")
+    logger.info(f"📢 Enviando contenido ID {content_id} '{content.get('title', '')}' a los usuarios activos")
     
-    for user_id in users:
-        try:
-            # Crear update falso para send_channel_post
-            chat_id = user_id
-            
-            # Simular estructura para send_channel_post
-            class FakeUpdate:
-                def __init__(self, user_id):
-                    self.effective_chat = type('obj', (object,), {'id': user_id})
-                    self.effective_user = type('obj', (object,), {'id': user_id})
-            
-            fake_update = FakeUpdate(user_id)
-            await send_channel_post(fake_update, context, content, user_id)
-            
-            # Pequeña pausa para evitar spam
-            import asyncio
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            logger.error(f"Error enviando contenido a usuario {user_id}: {e}")
+    # Caption, paid media y teclado se construyen una vez para toda la difusión
+    await get_content_parts(content)
+    # Compradores en un conjunto: sin consultar la base de datos por cada usuario
+    buyers = await content_bot.run(content_bot.buyers_of, content_id) if content['price_stars'] else set()
+    
+    async def send_to(user_id: int) -> str:
+        await send_content_to_chat(context, user_id, content, user_id, has_purchased=user_id in buyers)
+        return 'sent'
+    
+    results = await for_each_active_user(send_to)
+    logger.info(
+        f"📢 Contenido ID {content_id} enviado a {results['sent']} usuarios "
+        f"({results['blocked']} bloqueados, {results['failed']} errores)"
+    )
 
 async def broadcast_media_group(context: ContextTypes.DEFAULT_TYPE, content_id: int, media_items: List, title: str, description: str, price: int):
     """Envía grupo de medios a todos los usuarios registrados usando sendMediaGroup nativo"""
     logger.info(f"Iniciando broadcast de grupo {content_id} con {len(media_items)} archivos para precio {price}")
-    users = content_bot.get_all_users()
-    logger.info(f"Encontrados {len(users)} usuarios para enviar")
-    
     if not media_items:
         logger.error("No hay media_items para enviar")
         return
     
-    for user_id in users:
-        try:
-            logger.info(f"Enviando grupo a usuario {user_id}, precio: {price}")
-            if price > 0:
-                # Para contenido pagado, usar send_paid_media nativo
-                logger.info(f"Enviando paid media group a usuario {user_id}")
-                
-                # Convertir media_items (InputMedia*) a InputPaidMedia*
-                paid_media_items = []
-                for media_item in media_items:
-                    if hasattr(media_item, 'media'):  # Es InputMediaPhoto, InputMediaVideo, etc.
-                        if media_item.__class__.__name__ == 'InputMediaPhoto':
-                            paid_media_items.append(InputPaidMediaPhoto(media=media_item.media))
-                        elif media_item.__class__.__name__ == 'InputMediaVideo':
-                            paid_media_items.append(InputPaidMediaVideo(media=media_item.media))
-                
-                if paid_media_items:
-                    # Usar send_paid_media nativo de Telegram
-                    clean_description = escape_markdown(description)
-                    caption = f"**{clean_description}**"
-                    await context.bot.send_paid_media(
-                        chat_id=user_id,
-                        star_count=price,
-                        media=paid_media_items,
-                        caption=caption,
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"Paid media group enviado a usuario {user_id}")
-                else:
-                    logger.error(f"No se pudieron convertir media items a paid media para usuario {user_id}")
-            else:
-                # Para contenido gratuito, enviar el grupo completo directamente
-                logger.info(f"Enviando media group gratuito a usuario {user_id}")
-                await context.bot.send_media_group(
-                    chat_id=user_id,
-                    media=media_items
-                )
-                logger.info(f"Media group enviado a usuario {user_id}")
-            
-            # Pequeña pausa para evitar spam
-            import asyncio
-            await asyncio.sleep(0.2)
-        except Exception as e:
-            logger.error(f"Error enviando grupo a usuario {user_id}: {e}")
+    if price > 0:
+        # Para contenido pagado, usar send_paid_media nativo:
+        # convertir media_items (InputMedia*) a InputPaidMedia* una sola vez
+        paid_media_items = []
+        for media_item in media_items:
+            if hasattr(media_item, 'media'):  # Es InputMediaPhoto, InputMediaVideo, etc.
+                if media_item.__class__.__name__ == 'InputMediaPhoto':
+                    paid_media_items.append(InputPaidMediaPhoto(media=media_item.media))
+                elif media_item.__class__.__name__ == 'InputMediaVideo':
+                    paid_media_items.append(InputPaidMediaVideo(media=media_item.media))
+        
+        if not paid_media_items:
+            logger.error(f"No se pudieron convertir media items a paid media para el grupo {content_id}")
+            return
+        caption = f"**{escape_markdown(description)}**"
+    
+    async def send_to(user_id: int) -> str:
+        if price > 0:
+            await context.bot.send_paid_media(
+                chat_id=user_id,
+                star_count=price,
+                media=paid_media_items,
+                caption=caption,
+                parse_mode='Markdown'
+            )
+        else:
+            # Para contenido gratuito, enviar el grupo completo directamente
+            await context.bot.send_media_group(
+                chat_id=user_id,
+                media=media_items
+            )
+        return 'sent'
+    
+    # Un álbum gratuito llega como un mensaje por archivo; el de pago es un solo mensaje
+    messages_per_user = 1 if price > 0 else len(media_items)
+    results = await for_each_active_user(send_to, messages_per_user=messages_per_user)
+    logger.info(
+        f"Grupo {content_id} enviado a {results['sent']} usuarios "
+        f"({results['blocked']} bloqueados, {results['failed']} errores)"
+    )
 
 async def send_all_posts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Envía todas las publicaciones como si fuera un canal"""
     user_id = update.effective_user.id if update.effective_user else 0
-    content_list = content_bot.get_content_list()
+    chat_id = update.effective_chat.id if update.effective_chat else user_id
     
-    if not content_list:
+    if not await send_all_posts_to_chat(context, chat_id, user_id):
         # Si no hay contenido, enviar mensaje discreto solo si hay mensaje original
         if update.message:
             text = get_text(user_id, 'channel_empty')
             await update.message.reply_text(text)
-        return
+
+async def send_all_posts_to_chat(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> bool:
+    """Envía todas las publicaciones a un chat; devuelve False si no hay contenido"""
+    content_list = await content_bot.run(content_bot.get_content_list)
+    
+    if not content_list:
+        return False
+    
+    # Compras del usuario una sola vez para todas las publicaciones
+    owned = await content_bot.run(content_bot.purchased_set, user_id)
     
     # Enviar cada publicación como si fuera un post de canal
     for content in content_list:
-        await send_channel_post(update, context, content, user_id)
+        await send_content_to_chat(context, chat_id, content, user_id, has_purchased=content['id'] in owned)
         # Pequeña pausa entre posts para simular canal real
-        import asyncio
         await asyncio.sleep(0.5)
+    return True
 
-async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE, content: Dict, user_id: int):
-    """Envía una publicación individual como si fuera de un canal"""
-    chat_id = update.effective_chat.id if update.effective_chat else user_id
-    
-    # Obtener descripción del contenido
+async def send_media(bot, chat_id: int, content: Dict, caption: str):
+    """Envía una foto, video o documento con el método del bot que corresponde a su tipo"""
+    method_name, file_kwarg = MEDIA_SENDERS[content['media_type']]
+    await getattr(bot, method_name)(
+        chat_id=chat_id,
+        caption=caption,
+        parse_mode='Markdown',
+        **{file_kwarg: content['media_file_id']}
+    )
+
+async def get_content_parts(content: Dict) -> Dict:
+    """Construye una vez las piezas de envío que no dependen del destinatario"""
+    cache_key = (content_bot.catalog_version, content['id'])
+    parts = content_parts_cache.get(cache_key)
+    if parts is not None:
+        return parts
+    
+    # Todas las lecturas de ContentBot devuelven la descripción ya limpia
     caption = content.get("description", content.get("title", "Sin descripción"))
+    parts = {
+        'caption': caption,
+        'paid_caption': escape_markdown(caption) if caption else "",
+        'files': None,
+        'free_group': None,
+        'paid_media': None,
+        'unlock_markup': InlineKeyboardMarkup([[InlineKeyboardButton(
+            f"💰 Desbloquear por {content['price_stars']} ⭐",
+            callback_data=f"{UNLOCK_PREFIX}{content['id']}"
+        )]]),
+    }
+    
+    media_type = content['media_type']
+    if media_type == 'photo':
+        parts['paid_media'] = [InputPaidMediaPhoto(media=content['media_file_id'])]
+    elif media_type == 'video':
+        parts['paid_media'] = [InputPaidMediaVideo(media=content['media_file_id'])]
+    elif media_type == 'media_group':
+        # Obtener los archivos del JSON original del grupo
+        try:
+            group_data = await content_bot.run(content_bot.get_media_group_by_id, content['id'])
+        except Exception as e:
+            logger.error(f"Error obteniendo grupo de medios {content['id']}: {e}")
+            group_data = None
+        files = group_data.get('files') if group_data else None
+        if files:
+            parts['files'] = files
+            
+            # InputMedia* para el envío gratuito - ESTÁNDAR TELEGRAM: caption solo en primer elemento
+            free_group = []
+            paid_media = []
+            for i, file_data in enumerate(files):
+                caption_text = caption if i == 0 else None
+                if file_data['type'] == 'photo':
+                    free_group.append(InputMediaPhoto(
+                        media=file_data['file_id'],
+                        caption=caption_text,
+                        parse_mode='Markdown' if caption_text else None
+                    ))
+                    paid_media.append(InputPaidMediaPhoto(media=file_data['file_id']))
+                elif file_data['type'] == 'video':
+                    free_group.append(InputMediaVideo(
+                        media=file_data['file_id'],
+                        caption=caption_text,
+                        parse_mode='Markdown' if caption_text else None
+                    ))
+                    paid_media.append(InputPaidMediaVideo(media=file_data['file_id']))
+            parts['free_group'] = free_group
+            parts['paid_media'] = paid_media
+    
+    if len(content_parts_cache) >= CONTENT_PARTS_CACHE_SIZE:
+        content_parts_cache.clear()
+    content_parts_cache[cache_key] = parts
+    return parts
+
+async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE, content: Dict, user_id: int,
+                            has_purchased: Optional[bool] = None):
+    """Envía una publicación individual al chat de la actualización"""
+    chat_id = update.effective_chat.id if update.effective_chat else user_id
+    await send_content_to_chat(context, chat_id, content, user_id, has_purchased=has_purchased)
+
+async def send_content_to_chat(context: ContextTypes.DEFAULT_TYPE, chat_id: int, content: Dict, user_id: int,
+                               has_purchased: Optional[bool] = None):
+    """Envía una publicación individual como si fuera de un canal"""
+    # Caption, paid media y teclados ya construidos para esta versión del contenido
+    parts = await get_content_parts(content)
+    caption = parts['caption']
     
     # Log para diagnosticar el envío
     logger.info(f"Enviando contenido ID {content['id']} a usuario {user_id}")
     
-    # Verificar si el usuario ya compró el contenido
-    has_purchased = content_bot.has_purchased_content(user_id, content['id'])
+    # Verificar si el usuario ya compró el contenido (si el llamador no lo sabe ya)
+    if has_purchased is None:
+        has_purchased = await content_bot.run(content_bot.has_purchased_content, user_id, content['id'])
     
     # Si es contenido gratuito o ya fue comprado, mostrar directamente
     if content['price_stars'] == 0 or has_purchased:
-        if content['media_type'] == 'photo':
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=content['media_file_id'],
-                caption=caption,
-                parse_mode='Markdown'
-            )
-        elif content['media_type'] == 'video':
-            await context.bot.send_video(
-                chat_id=chat_id,
-                video=content['media_file_id'],
-                caption=caption,
-                parse_mode='Markdown'
-            )
-        elif content['media_type'] == 'document':
-            await context.bot.send_document(
-                chat_id=chat_id,
-                document=content['media_file_id'],
-                caption=caption,
-                parse_mode='Markdown'
-            )
+        if content['media_type'] in MEDIA_SENDERS:
+            await send_media(context.bot, chat_id, content, caption)
         elif content['media_type'] == 'media_group':
-            # Para grupos de medios gratuitos - obtener archivos del JSON original
+            # Para grupos de medios gratuitos - archivos del JSON original
             try:
-                # Obtener el grupo completo de la base de datos
-                group_data = content_bot.get_media_group_by_id(content['id'])
-                if group_data and group_data.get('files'):
-                    files = group_data['files']
-                    
-                    # Convertir a InputMedia* - ESTÁNDAR TELEGRAM: caption solo en primer elemento
-                    media_items = []
-                    for i, file_data in enumerate(files):
-                        # Según API oficial: caption SOLO en primer elemento
-                        caption_text = caption if i == 0 else None
-                        if file_data['type'] == 'photo':
-                            media_items.append(InputMediaPhoto(
-                                media=file_data['file_id'],
-                                caption=caption_text,
-                                parse_mode='Markdown' if caption_text else None
-                            ))
-                        elif file_data['type'] == 'video':
-                            media_items.append(InputMediaVideo(
-                                media=file_data['file_id'],
-                                caption=caption_text,
-                                parse_mode='Markdown' if caption_text else None
-                            ))
+                if parts['files']:
+                    media_items = parts['free_group']
                     
                     if media_items:
                         await context.bot.send_media_group(
@@ -875,12 +1576,11 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
             
             try:
                 # Usar send_paid_media nativo para fotos
-                paid_media = [InputPaidMediaPhoto(media=file_id)]
                 await context.bot.send_paid_media(
                     chat_id=chat_id,
                     star_count=content['price_stars'],
-                    media=paid_media,
-                    caption=escape_markdown(caption) if caption else "",
+                    media=parts['paid_media'],
+                    caption=parts['paid_caption'],
                     parse_mode='Markdown'
                 )
                 logger.info(f"Foto pagada enviada exitosamente a {chat_id}")
@@ -915,12 +1615,11 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
             
             try:
                 # Usar send_paid_media nativo para videos
-                paid_media = [InputPaidMediaVideo(media=file_id)]
                 await context.bot.send_paid_media(
                     chat_id=chat_id,
                     star_count=content['price_stars'],
-                    media=paid_media,
-                    caption=escape_markdown(caption) if caption else "",
+                    media=parts['paid_media'],
+                    caption=parts['paid_caption'],
                     parse_mode='Markdown'
                 )
                 logger.info(f"Video pagado enviado exitosamente a {chat_id}")
@@ -942,20 +1641,11 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
                         parse_mode='Markdown'
                     )
         elif content['media_type'] == 'media_group':
-            # Para grupos de medios pagados - necesitamos obtener los archivos del JSON original
+            # Para grupos de medios pagados - archivos del JSON original
             try:
-                # Obtener el grupo completo de la base de datos
-                group_data = content_bot.get_media_group_by_id(content['id'])
-                if group_data and group_data.get('files'):
-                    files = group_data['files']
-                    
-                    # Convertir a InputPaidMedia*
-                    paid_media_items = []
-                    for file_data in files:
-                        if file_data['type'] == 'photo':
-                            paid_media_items.append(InputPaidMediaPhoto(media=file_data['file_id']))
-                        elif file_data['type'] == 'video':
-                            paid_media_items.append(InputPaidMediaVideo(media=file_data['file_id']))
+                if parts['files']:
+                    files = parts['files']
+                    paid_media_items = parts['paid_media']
                     
                     if paid_media_items:
                         try:
@@ -963,7 +1653,7 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
                                 chat_id=chat_id,
                                 star_count=content['price_stars'],
                                 media=paid_media_items,
-                                caption=escape_markdown(caption) if caption else "",
+                                caption=parts['paid_caption'],
                                 parse_mode='Markdown'
                             )
                             logger.info(f"Grupo de medios pagado enviado exitosamente a {chat_id}")
@@ -1013,12 +1703,7 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
             # Usar descripción traducida para documento premium bloqueado
             description_text = content.get("description", content.get("title", "Sin descripción"))
             blocked_text = f"{stars_text}\n\n🔒 **{content['title']}**\n\n_Documento premium_\n\n{description_text}"
-            
-            keyboard = [[InlineKeyboardButton(
-                f"💰 Desbloquear por {content['price_stars']} ⭐", 
-                callback_data=f"unlock_{content['id']}"
-            )]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = parts['unlock_markup']
             
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -1029,11 +1714,7 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
         else:
             # Para texto, simular el spoiler con botón invisible
             stars_text = f"⭐ {content['price_stars']} estrellas"
-            keyboard = [[InlineKeyboardButton(
-                f"💰 Desbloquear por {content['price_stars']} ⭐", 
-                callback_data=f"unlock_{content['id']}"
-            )]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = parts['unlock_markup']
             
             # Usar formato simple sin spoiler para evitar errores de parseo
             preview_text = f"{stars_text}\n\n🔒 **{escape_markdown(content['title'])}**\n\nContenido bloqueado - Haz clic para desbloquear"
@@ -1047,147 +1728,313 @@ async def send_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE,
 # Instancia global del bot
 content_bot = ContentBot()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /start - Simula la experiencia de un canal tradicional"""
-    user = update.effective_user
-    if not user or not update.message:
+def write_purchase_batch(batch: List[tuple]):
+    """Escribe un lote de compras ya cobradas; si no se puede, lo aparta en disco para reintentarlo al arrancar"""
+    # El acceso ya se dio al cobrar (grant_purchases): aquí solo importa no perder el registro
+    for attempt in range(PURCHASE_WRITE_ATTEMPTS):
+        try:
+            content_bot.record_purchases(batch)
+            return
+        except Exception as e:
+            logger.error(f"Error registrando {len(batch)} compra(s) (intento {attempt + 1}): {e}")
+            if attempt + 1 < PURCHASE_WRITE_ATTEMPTS:
+                time.sleep(0.5 * 2 ** attempt)
+    
+    try:
+        with open(PENDING_PURCHASES_FILE, 'a', encoding='utf-8') as pending:
+            for purchase in batch:
+                pending.write(json_dumps(purchase) + '\n')
+        logger.error(f"{len(batch)} compra(s) apartada(s) en {PENDING_PURCHASES_FILE} - Datos: {batch}")
+    except OSError as e:
+        logger.critical(f"Compras cobradas sin guardar: {e} - Datos: {batch}")
+
+def replay_pending_purchases():
+    """Guarda las compras que quedaron apartadas en disco por un fallo de escritura"""
+    try:
+        with open(PENDING_PURCHASES_FILE, encoding='utf-8') as pending:
+            batch = [tuple(json_loads(line)) for line in pending if line.strip()]
+    except FileNotFoundError:
         return
     
+    # payment_id es único: repetir una compra ya guardada no la duplica
+    content_bot.record_purchases(batch)
+    os.remove(PENDING_PURCHASES_FILE)
+    logger.info(f"{len(batch)} compra(s) pendiente(s) recuperada(s) de {PENDING_PURCHASES_FILE}")
+
+def write_user_batch(batch: List[tuple]):
+    """Escribe un lote de registros de usuario"""
+    try:
+        content_bot.register_users(batch)
+    except Exception as e:
+        logger.error(f"Error registrando {len(batch)} usuario(s): {e}")
+
+class BatchWriter:
+    """Cola de escrituras que una tarea en segundo plano vuelca en lotes, una transacción por lote"""
+    
+    def __init__(self, write_batch):
+        self.write_batch = write_batch
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+    
+    async def put(self, item: tuple):
+        """Encola un elemento; si el escritor no está activo se escribe directamente"""
+        if self.task is None or self.task.done():
+            await content_bot.run(self.write_batch, [item])
+        else:
+            await self.queue.put(item)
+    
+    async def _run(self):
+        """Agrupa lo encolado durante WRITE_FLUSH_INTERVAL o hasta WRITE_BATCH_SIZE elementos"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + WRITE_FLUSH_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await content_bot.run(self.write_batch, batch)
+    
+    def start(self):
+        """Arranca la tarea en segundo plano"""
+        # La cola se crea aquí para que quede ligada al bucle de eventos en marcha
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Detiene la tarea y vuelca lo que quede en la cola"""
+        if self.task is not None:
+            # Se avisa con None en lugar de cancelar para no perder el lote en curso
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+        
+        batch = []
+        while self.queue is not None and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await content_bot.run(self.write_batch, batch)
+
+# Escrituras diferidas: compras y registros de usuario
+purchase_writer = BatchWriter(write_purchase_batch)
+user_writer = BatchWriter(write_user_batch)
+
+# Tarea periódica de mantenimiento de la base de datos
+maintenance_task: Optional[asyncio.Task] = None
+
+async def database_maintenance():
+    """Devuelve al sistema las páginas libres y refresca las estadísticas cada VACUUM_INTERVAL segundos"""
+    while True:
+        await asyncio.sleep(VACUUM_INTERVAL)
+        try:
+            await content_bot.run(content_bot.incremental_vacuum, VACUUM_PAGES)
+            await content_bot.run(content_bot.optimize)
+        except Exception as e:
+            logger.error(f"Error en el mantenimiento de la base de datos: {e}")
+
+async def start_background_tasks(application: Application):
+    """Arranca los escritores y el mantenimiento en segundo plano"""
+    global maintenance_task
+    try:
+        await content_bot.run(replay_pending_purchases)
+    except Exception as e:
+        logger.error(f"No se pudieron recuperar las compras pendientes: {e}")
+    purchase_writer.start()
+    user_writer.start()
+    maintenance_task = asyncio.create_task(database_maintenance())
+
+async def stop_background_tasks(application: Application):
+    """Detiene las tareas en segundo plano y vuelca las escrituras pendientes"""
+    global maintenance_task
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+        try:
+            await maintenance_task
+        except asyncio.CancelledError:
+            pass
+        maintenance_task = None
+    
+    await purchase_writer.stop()
+    await user_writer.stop()
+
+def remember_content(context: ContextTypes.DEFAULT_TYPE, content: Dict):
+    """Guarda en user_data el contenido visto para reutilizarlo en la compra"""
+    if context.user_data is not None:
+        context.user_data[f"content_{content['id']}"] = (time.monotonic() + USER_CONTENT_TTL, content)
+
+async def recall_content(context: ContextTypes.DEFAULT_TYPE, content_id: int) -> Optional[Dict]:
+    """Obtiene el contenido de user_data si sigue vigente; si no, de la base de datos"""
+    cached = context.user_data.get(f"content_{content_id}") if context.user_data is not None else None
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
     
+    content = await content_bot.run(content_bot.get_content_by_id, content_id)
+    if content:
+        remember_content(context, content)
+    return content
+
+def needs_user_message(handler):
+    """Decorador: solo ejecuta el comando si la actualización trae usuario y mensaje, y se los pasa ya extraídos"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        message = update.message
+        if not user or not message:
+            return
+        return await handler(update, context, user, message)
+    return wrapper
+
+@needs_user_message
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
+    """Comando /start - Simula la experiencia de un canal tradicional"""
     # Registrar usuario silenciosamente
-    content_bot.register_user(
-        user.id, user.username or '', user.first_name or '', user.last_name or ''
+    await user_writer.put(
+        (user.id, user.username or '', user.first_name or '', user.last_name or '')
     )
     
     # Enviar publicaciones directamente (experiencia de canal)
     logger.info(f"✅ Usuario {user.id} accediendo al contenido del canal")
     await send_all_posts(update, context)
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Comando /ayuda"""
-    if not update.message:
-        return
-        
     # Obtener mensaje personalizado de la base de datos
-    help_text = content_bot.get_setting('help_message', '''📋 **Comandos Disponibles:**
+    help_text = await content_bot.run(content_bot.get_setting, 'help_message', MESSAGES['help_message'])
+    
+    await message.reply_text(help_text, parse_mode='Markdown')
 
-🎬 *Para usuarios:*
-/start - Mensaje de bienvenida
-/catalogo - Ver contenido disponible
-/ayuda - Esta ayuda
 
-💫 *Sobre las estrellas:*
-• Las estrellas ⭐ son la moneda oficial de Telegram
-• Se compran directamente en Telegram
-• Permiten acceder a contenido premium
+def catalog_button_text(content: Dict, purchased: bool) -> str:
+    """Texto del botón de un contenido en el catálogo"""
+    if content['price_stars'] == 0:
+        price_text = "GRATIS"
+    elif purchased:
+        price_text = "✅ Comprado"
+    else:
+        price_text = f"{content['price_stars']} ⭐"
+    status_text = "" if content['is_active'] else " [INACTIVO]"
+    return f"📺 {content['title']} - {price_text}{status_text}"
 
-❓ *¿Necesitas ayuda?*
-Si tienes problemas, contacta al administrador del canal.''')
+async def build_catalog_markup(user_id: int, page: int) -> Optional[InlineKeyboardMarkup]:
+    """Construye el teclado de una página del catálogo (None si no hay contenido)"""
+    catalog_version = content_bot.catalog_version
+    page = max(0, page)
+    page_content, total = await content_bot.run(
+        content_bot.get_content_page, user_id, page * CATALOG_PAGE_SIZE, CATALOG_PAGE_SIZE
+    )
     
-    await update.message.reply_text(help_text, parse_mode='Markdown')
-
-
-async def catalog_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /catalogo"""
-    if not update.effective_user or not update.message:
-        return
-        
-    user_id = update.effective_user.id
-    content_list = content_bot.get_content_list(user_id)
+    if not total:
+        return None
     
-    if not content_list:
-        await update.message.reply_text(
-            "📭 Aún no hay contenido disponible.\n\n"
-            "¡Mantente atento! Pronto habrá contenido nuevo."
+    last_page = (total - 1) // CATALOG_PAGE_SIZE
+    if page > last_page:
+        # Página fuera de rango (el catálogo encogió): mostrar la última
+        page = last_page
+        page_content, total = await content_bot.run(
+            content_bot.get_content_page, user_id, page * CATALOG_PAGE_SIZE, CATALOG_PAGE_SIZE
         )
-        return
     
-    # Crear botones para cada contenido
-    keyboard = []
-    for content in content_list:
-        price_text = "GRATIS" if content['price_stars'] == 0 else f"{content['price_stars']} ⭐"
-        status_text = "" if content.get('is_active', True) else " [INACTIVO]"
-        
-        button_text = f"📺 {content['title']} - {price_text}{status_text}"
-        keyboard.append([InlineKeyboardButton(
-            button_text, 
-            callback_data=f"view_content_{content['id']}"
-        )])
+    # Estado de compra de la página (una consulta como mucho, luego en memoria)
+    purchased_ids = await content_bot.run(
+        content_bot.purchased_ids, user_id, [content['id'] for content in page_content]
+    )
+    
+    # El teclado solo depende del catálogo, del rol, de la página y de lo comprado
+    cache_key = (content_bot.is_admin(user_id), page, frozenset(purchased_ids))
+    cached = catalog_markup_cache.get(cache_key)
+    if cached and cached[0] == catalog_version:
+        return cached[1]
+    
+    # Crear botones para cada contenido en una sola pasada
+    keyboard = [
+        [InlineKeyboardButton(
+            catalog_button_text(content, content['id'] in purchased_ids),
+            callback_data=f"{VIEW_PREFIX}{content['id']}"
+        )]
+        for content in page_content
+    ]
+    
+    # Navegación solo si el catálogo no cabe en una página
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"{CATALOG_PAGE_PREFIX}{page - 1}"))
+    if page < last_page:
+        navigation.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"{CATALOG_PAGE_PREFIX}{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
+    if len(catalog_markup_cache) >= CATALOG_MARKUP_CACHE_SIZE:
+        catalog_markup_cache.clear()
+    catalog_markup_cache[cache_key] = (catalog_version, reply_markup)
+    return reply_markup
+
+@needs_user_message
+async def catalog_command(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
+    """Comando /catalogo"""
+    user_id = user.id
+    reply_markup = await build_catalog_markup(user_id, 0)
     
-    await update.message.reply_text(
-        "📺 **Catálogo de Contenido**\n\n"
-        "Selecciona el contenido que deseas ver:",
+    if not reply_markup:
+        await message.reply_text(MESSAGES['catalog_empty'])
+        return
+    
+    await message.reply_text(
+        MESSAGES['catalog_title'],
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
 
-async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Comando /admin - Panel de administración"""
-    if not update.effective_user or not update.message:
-        return
-        
-    user_id = update.effective_user.id
+    user_id = user.id
     
     if not content_bot.is_admin(user_id):
-        await update.message.reply_text("❌ No tienes permisos para acceder al panel de administración.")
+        await message.reply_text("❌ No tienes permisos para acceder al panel de administración.")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("➕ Añadir Contenido", callback_data="admin_add_content")],
-        [InlineKeyboardButton("📋 Gestionar Contenido", callback_data="admin_manage_content")],
-        [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")],
-        [InlineKeyboardButton("⚙️ Configuración", callback_data="admin_settings")],
-        [InlineKeyboardButton("✏️ Mensaje de Ayuda", callback_data="admin_help_message")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        "🔧 **Panel de Administración**\n\n"
-        "Selecciona una opción:",
-        reply_markup=reply_markup,
+    await message.reply_text(
+        MESSAGES['admin_panel'],
+        reply_markup=ADMIN_PANEL_MARKUP,
         parse_mode='Markdown'
     )
 
-async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Comando /menu - Menú completo de comandos para administrador"""
-    if not update.effective_user or not update.message:
-        return
-        
-    user_id = update.effective_user.id
+    user_id = user.id
     
     if not content_bot.is_admin(user_id):
-        await update.message.reply_text("❌ Este comando es solo para administradores.")
+        await message.reply_text("❌ Este comando es solo para administradores.")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("🔧 Panel Admin", callback_data="quick_admin")],
-        [InlineKeyboardButton("➕ Subir Contenido", callback_data="quick_upload"), 
-         InlineKeyboardButton("📋 Gestionar", callback_data="admin_manage_content")],
-        [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    menu_text = (
-        "📋 **MENÚ DE ADMINISTRADOR**\n\n"
-        "**Comandos Disponibles:**\n"
-        "• `/admin` - Panel principal\n"
-        "• `/menu` - Este menú\n"
-        "• `/start` - Ver como usuario\n"
-        "• `/ayuda` - Ayuda del bot\n"
-        "• `/catalogo` - Ver catálogo\n\n"
-        "**Acceso Rápido:**"
-    )
-    
-    await update.message.reply_text(
-        menu_text,
-        reply_markup=reply_markup,
+    await message.reply_text(
+        MESSAGES['admin_menu'],
+        reply_markup=ADMIN_MENU_MARKUP,
         parse_mode='Markdown'
     )
 
+# Función auxiliar para enviar posts desde callback
+async def send_all_posts_callback(query, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Envía todas las publicaciones desde un callback"""
+    if not await send_all_posts_to_chat(context, user_id, user_id):
+        text = get_text(user_id, 'channel_empty')
+        await context.bot.send_message(chat_id=user_id, text=text)
+
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejador de callbacks de botones inline"""
     query = update.callback_query
@@ -1208,915 +2055,843 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     context.processed_callbacks.add(callback_id)
     
+    handler = find_callback_handler(data)
+    if handler:
+        await handler(update, context, query, data, user_id)
 
+def find_callback_handler(data: str):
+    """Busca el manejador de un callback: primero por valor exacto y luego por el prefijo más largo"""
+    handler = CALLBACK_HANDLERS.get(data)
+    if handler:
+        return handler
+    
+    for prefix, handler in CALLBACK_PREFIX_HANDLERS.get(data.partition("_")[0], ()):
+        if data.startswith(prefix):
+            return handler
+    return None
 
-# Función auxiliar para enviar posts desde callback
-async def send_all_posts_callback(query, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Envía todas las publicaciones desde un callback"""
-    content_list = content_bot.get_content_list()
+def admin_only(handler):
+    """Decorador: solo ejecuta el callback si el usuario es administrador"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+        if not content_bot.is_admin(user_id):
+            await query.edit_message_text("❌ Sin permisos de administrador.")
+            return
+        await handler(update, context, query, data, user_id)
+    return wrapper
+
+async def callback_unlock(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Envía la factura para desbloquear un contenido de pago"""
+    content_id = int(data[len(UNLOCK_PREFIX):])
+    # Contenido y estado de compra en una sola consulta
+    content = await content_bot.run(content_bot.get_content_and_access, content_id, user_id)
+    
+    if not content or not content['is_active']:
+        await query.answer("❌ Contenido no encontrado.", show_alert=True)
+        return
     
-    if not content_list:
-        text = get_text(user_id, 'channel_empty')
-        await context.bot.send_message(chat_id=user_id, text=text)
+    # Verificar si ya compró el contenido
+    if content['purchased']:
+        await query.answer("✅ Ya tienes acceso a este contenido.", show_alert=True)
         return
     
-    # Enviar cada publicación
-    for content in content_list:
-        await send_channel_post_from_callback(query, context, content, user_id)
-        # Pequeña pausa entre posts
-        import asyncio
-        await asyncio.sleep(0.5)
+    # Se reutiliza al confirmar el pago
+    remember_content(context, content)
+    
+    # Activar sistema de pago con estrellas nativo
+    await query.answer()
+    
+    # Crear factura de pago con estrellas
+    prices = [LabeledPrice(content['title'], content['price_stars'])]
+    
+    await context.bot.send_invoice(
+        chat_id=user_id,
+        title=f"🌟 {content['title']}",
+        description=content['description'],
+        payload=f"{PAYLOAD_PREFIX}{content_id}",
+        provider_token="",  # Para estrellas de Telegram, se deja vacío
+        currency="XTR",  # XTR es para estrellas de Telegram
+        prices=prices
+    )
 
-# Función auxiliar para enviar posts desde callback (simplificada)  
-async def send_channel_post_from_callback(query, context: ContextTypes.DEFAULT_TYPE, content: Dict, user_id: int):
-    """Versión simplificada de send_channel_post para callbacks"""
-    # Por ahora redirigimos al método principal creando un update simulado
-    from telegram import Update
+async def callback_view_content(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra una publicación elegida desde el catálogo"""
+    content_id = int(data[len(VIEW_PREFIX):])
+    
+    # Contenido y estado de compra en una sola consulta
+    content = await content_bot.run(content_bot.get_content_and_access, content_id, user_id)
     
-    # Crear un update simulado para usar send_channel_post
-    fake_update = type('FakeUpdate', (), {
-        'effective_chat': type('FakeChat', (), {'id': user_id})(),
-        'effective_user': type('FakeUser', (), {'id': user_id})()
-    })()
+    if not content or not (content['is_active'] or content_bot.is_admin(user_id)):
+        await context.bot.send_message(chat_id=user_id, text="❌ Contenido no encontrado.")
+        return
     
-    await send_channel_post(fake_update, context, content, user_id)
+    # Se reutiliza si el usuario pulsa comprar a continuación
+    if content['is_active']:
+        remember_content(context, content)
+    await send_channel_post(update, context, content, user_id, has_purchased=content['purchased'])
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Manejador de callbacks de botones inline"""
-    query = update.callback_query
-    if not query or not query.from_user or not query.data:
+async def callback_catalog_page(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Cambia de página en el catálogo"""
+    reply_markup = await build_catalog_markup(user_id, int(data[len(CATALOG_PAGE_PREFIX):]))
+    
+    if not reply_markup:
+        await query.edit_message_text(MESSAGES['catalog_empty'])
         return
-        
-    user_id = query.from_user.id
-    data = query.data
     
-    # Protección contra callbacks duplicados
-    callback_id = f"{user_id}_{data}_{query.id}"
-    if hasattr(context, 'processed_callbacks'):
-        if callback_id in context.processed_callbacks:
-            return
-    else:
-        context.processed_callbacks = set()
+    await query.edit_message_reply_markup(reply_markup=reply_markup)
+
+@admin_only
+async def callback_admin_add_content(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Explica cómo subir contenido nuevo"""
+    await query.edit_message_text(MESSAGES['admin_add_content'], parse_mode='Markdown')
+
+@admin_only
+async def callback_admin_manage_content(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Lista el contenido para gestionarlo"""
+    content_list = await content_bot.run(content_bot.get_content_list)
     
-    await query.answer()
-    context.processed_callbacks.add(callback_id)
+    if not content_list:
+        await query.edit_message_text("📭 No hay contenido para gestionar.")
+        return
+    
+    keyboard = []
+    for content in content_list:
+        status = "✅" if content['is_active'] else "❌"
+        keyboard.append([InlineKeyboardButton(
+            f"{status} {content['title']} ({content['price_stars']} ⭐)",
+            callback_data=f"{MANAGE_PREFIX}{content['id']}"
+        )])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
     
+    await query.edit_message_text(
+        "📋 **Gestionar Contenido**\n\n"
+        "Selecciona el contenido a gestionar:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
 
+def format_top_content(top_content) -> str:
+    """Lista numerada del contenido más vendido, una línea por contenido"""
+    return "".join(f"{i}. {title}: {sales} ventas\n" for i, (title, sales) in enumerate(top_content, 1))
+
+@admin_only
+async def callback_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra las estadísticas del bot"""
+    stats = await content_bot.run(content_bot.get_stats)
     
-    if data.startswith("unlock_"):
-        content_id = int(data.split("_")[1])
-        content = content_bot.get_content_by_id(content_id)
-        
-        if not content:
-            await query.answer("❌ Contenido no encontrado.", show_alert=True)
-            return
-        
-        # Verificar si ya compró el contenido
-        if content_bot.has_purchased_content(user_id, content_id):
-            await query.answer("✅ Ya tienes acceso a este contenido.", show_alert=True)
-            return
-        
-        # Activar sistema de pago con estrellas nativo
-        await query.answer()
-        
-        # Crear factura de pago con estrellas
-        prices = [LabeledPrice(content['title'], content['price_stars'])]
-        
-        await context.bot.send_invoice(
-            chat_id=user_id,
-            title=f"🌟 {content['title']}",
-            description=content['description'],
-            payload=f"content_{content_id}",
-            provider_token="",  # Para estrellas de Telegram, se deja vacío
-            currency="XTR",  # XTR es para estrellas de Telegram
-            prices=prices
-        )
+    # Formatear top content
+    top_content_text = format_top_content(stats['top_content'][:3]) or MESSAGES['stats_no_sales']
     
-    # Callback anterior removido - ahora se usa unlock_ en su lugar
+    reply_markup = BACK_TO_ADMIN_MARKUP
     
-    elif data.startswith("admin_"):
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-        
-        if data == "admin_add_content":
-            await query.edit_message_text(
-                "➕ **Añadir Contenido**\n\n"
-                "Para añadir contenido, envía el archivo (foto, video o documento) "
-                "seguido del comando:\n\n"
-                "`/add_content Título|Descripción|Precio_en_estrellas`\n\n"
-                "Ejemplo:\n"
-                "`/add_content Mi Video Premium|Video exclusivo de alta calidad|50`",
-                parse_mode='Markdown'
-            )
-        
-        elif data == "admin_manage_content":
-            content_list = content_bot.get_content_list()
-            
-            if not content_list:
-                await query.edit_message_text("📭 No hay contenido para gestionar.")
-                return
-            
-            keyboard = []
-            for content in content_list:
-                status = "✅" if content.get('is_active', True) else "❌"
-                keyboard.append([InlineKeyboardButton(
-                    f"{status} {content['title']} ({content['price_stars']} ⭐)",
-                    callback_data=f"manage_content_{content['id']}"
-                )])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "📋 **Gestionar Contenido**\n\n"
-                "Selecciona el contenido a gestionar:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        
-        elif data == "admin_stats":
-            stats = content_bot.get_stats()
-            
-            # Formatear top content
-            top_content_text = ""
-            if stats['top_content']:
-                for i, (title, sales) in enumerate(stats['top_content'][:3], 1):
-                    top_content_text += f"{i}. {title}: {sales} ventas\n"
-            else:
-                top_content_text = "Sin ventas aún"
-            
-            keyboard = [[InlineKeyboardButton("⬅️ Volver", callback_data="admin_back")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f"📊 **Estadísticas del Bot**\n\n"
-                f"👥 **Usuarios registrados:** {stats['total_users']}\n"
-                f"📁 **Contenido publicado:** {stats['total_content']}\n"
-                f"💰 **Ventas realizadas:** {stats['total_sales']}\n"
-                f"⭐ **Estrellas ganadas:** {stats['total_stars']}\n\n"
-                f"🏆 **Top contenido:**\n{top_content_text}",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        
-        elif data == "admin_settings":
-            keyboard = [
-                [InlineKeyboardButton("🗑️ Limpiar chats de usuarios", callback_data="clean_user_chats")],
-                [InlineKeyboardButton("⬅️ Volver", callback_data="admin_back")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f"⚙️ **Configuración del Bot**\n\n"
-                f"Opciones de gestión avanzada:",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        
-        elif data == "admin_help_message":
-            # Obtener mensaje actual
-            current_message = content_bot.get_setting('help_message', 'No configurado')
-            
-            keyboard = [
-                [InlineKeyboardButton("✏️ Cambiar Mensaje", callback_data="change_help_message")],
-                [InlineKeyboardButton("👀 Vista Previa", callback_data="preview_help_message")],
-                [InlineKeyboardButton("🔄 Restaurar Original", callback_data="reset_help_message")],
-                [InlineKeyboardButton("⬅️ Volver", callback_data="admin_back")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Mostrar preview truncado
-            preview = current_message[:200] + "..." if len(current_message) > 200 else current_message
-            
-            await query.edit_message_text(
-                f"✏️ **Personalización del Mensaje de Ayuda**\n\n"
-                f"📝 **Mensaje actual:**\n"
-                f"```\n{preview}\n```\n\n"
-                f"Usa los botones para gestionar el mensaje:",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        
-        elif data == "admin_back":
-            keyboard = [
-                [InlineKeyboardButton("➕ Añadir Contenido", callback_data="admin_add_content")],
-                [InlineKeyboardButton("📋 Gestionar Contenido", callback_data="admin_manage_content")],
-                [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")],
-                [InlineKeyboardButton("⚙️ Configuración", callback_data="admin_settings")],
-                [InlineKeyboardButton("✏️ Mensaje de Ayuda", callback_data="admin_help_message")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "🔧 **Panel de Administración**\n\n"
-                "Selecciona una opción:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+    await query.edit_message_text(
+        MESSAGES['stats'].format_map(stats) + top_content_text,
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@admin_only
+async def callback_admin_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra la configuración del bot"""
+    reply_markup = ADMIN_SETTINGS_MARKUP
     
-    # Nuevos callbacks para configuración de contenido
+    await query.edit_message_text(
+        f"⚙️ **Configuración del Bot**\n\n"
+        f"Opciones de gestión avanzada:",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@admin_only
+async def callback_admin_help_message(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra el mensaje de ayuda actual y sus opciones"""
+    # Obtener mensaje actual
+    current_message = await content_bot.run(content_bot.get_setting, 'help_message', 'No configurado')
     
-    elif data == "setup_description":
-        context.user_data['waiting_for'] = 'description'
-        await query.edit_message_text(
-            "📝 **Establecer Descripción**\n\n"
-            "Envía la descripción para tu publicación:",
-            parse_mode='Markdown'
-        )
+    reply_markup = HELP_MESSAGE_MARKUP
     
-    elif data == "setup_price":
-        price_keyboard = [
-            [InlineKeyboardButton("Gratuito (0 ⭐)", callback_data="price_0")],
-            [InlineKeyboardButton("5 ⭐", callback_data="price_5"), InlineKeyboardButton("10 ⭐", callback_data="price_10")],
-            [InlineKeyboardButton("25 ⭐", callback_data="price_25"), InlineKeyboardButton("50 ⭐", callback_data="price_50")],
-            [InlineKeyboardButton("100 ⭐", callback_data="price_100"), InlineKeyboardButton("200 ⭐", callback_data="price_200")],
-            [InlineKeyboardButton("✏️ Precio personalizado", callback_data="price_custom")],
-            [InlineKeyboardButton("⬅️ Volver", callback_data="back_to_setup")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(price_keyboard)
-        
+    # Mostrar preview truncado
+    preview = current_message[:200] + "..." if len(current_message) > 200 else current_message
+    
+    await query.edit_message_text(
+        f"✏️ **Personalización del Mensaje de Ayuda**\n\n"
+        f"📝 **Mensaje actual:**\n"
+        f"```\n{preview}\n```\n\n"
+        f"Usa los botones para gestionar el mensaje:",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@admin_only
+async def callback_admin_back(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Vuelve al panel de administración"""
+    await query.edit_message_text(
+        MESSAGES['admin_panel'],
+        reply_markup=ADMIN_PANEL_MARKUP,
+        parse_mode='Markdown'
+    )
+
+# Nuevos callbacks para configuración de contenido
+async def callback_setup_description(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Pide la descripción del contenido pendiente"""
+    context.user_data['waiting_for'] = 'description'
+    await query.edit_message_text(
+        "📝 **Establecer Descripción**\n\n"
+        "Envía la descripción para tu publicación:",
+        parse_mode='Markdown'
+    )
+
+async def callback_setup_price(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra los precios para el contenido pendiente"""
+    reply_markup = PRICE_MARKUP
+    
+    await query.edit_message_text(
+        "💰 **Establecer Precio**\n\n"
+        "Selecciona el precio en estrellas para tu contenido:",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def callback_price(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Aplica el precio elegido al contenido pendiente"""
+    if data == "price_custom":
+        context.user_data['waiting_for'] = 'custom_price'
         await query.edit_message_text(
-            "💰 **Establecer Precio**\n\n"
-            "Selecciona el precio en estrellas para tu contenido:",
-            parse_mode='Markdown',
-            reply_markup=reply_markup
+            "💰 **Precio Personalizado**\n\n"
+            "Envía el número de estrellas (ejemplo: 75):",
+            parse_mode='Markdown'
         )
+    else:
+        price = int(data.rpartition("_")[2])
+        context.user_data['pending_media'].price = price
+        await show_content_preview(query, context)
+
+async def callback_back_to_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Vuelve a la vista previa del contenido pendiente"""
+    await show_content_preview(query, context)
+
+async def callback_publish_content(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Publica el contenido pendiente"""
+    media_data = context.user_data.get('pending_media')
     
-    elif data.startswith("price_"):
-        if data == "price_custom":
-            context.user_data['waiting_for'] = 'custom_price'
-            await query.edit_message_text(
-                "💰 **Precio Personalizado**\n\n"
-                "Envía el número de estrellas (ejemplo: 75):",
-                parse_mode='Markdown'
-            )
-        else:
-            price = int(data.split("_")[1])
-            context.user_data['pending_media']['price'] = price
-            await show_content_preview(query, context)
+    if not media_data or not media_data.description:
+        await query.answer("❌ Falta descripción", show_alert=True)
+        return
     
-    elif data == "back_to_setup":
-        await show_content_preview(query, context)
+    # Crear título simple basado en el tipo de contenido
+    media_type = media_data.type
+    if media_type == 'photo':
+        title = "📷 Foto"
+    elif media_type == 'video':
+        title = "🎥 Video"
+    elif media_type == 'document':
+        title = "📄 Documento"
+    else:
+        title = "📁 Contenido"
+    
+    # Publicar contenido
+    content_id = await content_bot.run(
+        content_bot.add_content,
+        title,  # Título simple
+        media_data.description,  # Solo descripción
+        media_data.type,
+        media_data.file_id,
+        media_data.price
+    )
     
-    elif data == "publish_content":
-        media_data = context.user_data.get('pending_media', {})
-        
-        if not media_data.get('description'):
-            await query.answer("❌ Falta descripción", show_alert=True)
-            return
-        
-        # Crear título simple basado en el tipo de contenido
-        media_type = media_data['type']
-        if media_type == 'photo':
-            title = "📷 Foto"
-        elif media_type == 'video':
-            title = "🎥 Video"
-        elif media_type == 'document':
-            title = "📄 Documento"
-        else:
-            title = "📁 Contenido"
-        
-        # Publicar contenido
-        content_id = content_bot.add_content(
-            title,  # Título simple
-            media_data['description'],  # Solo descripción
-            media_data['type'],
-            media_data['file_id'],
-            media_data['price']
+    if content_id:
+        await query.edit_message_text(
+            f"✅ **¡Contenido publicado!**\n\n"
+            f"📝 **Descripción:** {media_data.description}\n"
+            f"💰 **Precio:** {media_data.price} estrellas\n\n"
+            f"📡 **Enviando a todos los usuarios...**",
+            parse_mode='Markdown'
         )
         
-        if content_id:
-            await query.edit_message_text(
-                f"✅ **¡Contenido publicado!**\n\n"
-                f"📝 **Descripción:** {media_data['description']}\n"
-                f"💰 **Precio:** {media_data['price']} estrellas\n\n"
-                f"📡 **Enviando a todos los usuarios...**",
-                parse_mode='Markdown'
-            )
-            
-            # Enviar automáticamente a todos los usuarios
-            await broadcast_new_content(context, content_id)
-            
-            # Actualizar mensaje de confirmación
-            await query.edit_message_text(
-                f"✅ **¡Contenido publicado y enviado!**\n\n"
-                f"📝 **Descripción:** {media_data['description']}\n"
-                f"💰 **Precio:** {media_data['price']} estrellas\n\n"
-                f"✉️ **Enviado a todos los usuarios del canal**",
-                parse_mode='Markdown'
-            )
-            
-            # Limpiar datos
-            if 'pending_media' in context.user_data:
-                del context.user_data['pending_media']
-            if 'waiting_for' in context.user_data:
-                del context.user_data['waiting_for']
-        else:
-            await query.answer("❌ Error al publicar", show_alert=True)
-    
-    elif data == "cancel_upload":
+        # Enviar automáticamente a todos los usuarios
+        await broadcast_new_content(context, content_id)
+        
+        # Actualizar mensaje de confirmación
         await query.edit_message_text(
-            "❌ **Subida cancelada**\n\n"
-            "El archivo no se ha publicado.",
+            f"✅ **¡Contenido publicado y enviado!**\n\n"
+            f"📝 **Descripción:** {media_data.description}\n"
+            f"💰 **Precio:** {media_data.price} estrellas\n\n"
+            f"✉️ **Enviado a todos los usuarios del canal**",
             parse_mode='Markdown'
         )
+        
         # Limpiar datos
         if 'pending_media' in context.user_data:
             del context.user_data['pending_media']
-        if 'media_group' in context.user_data:
-            del context.user_data['media_group']
         if 'waiting_for' in context.user_data:
             del context.user_data['waiting_for']
+    else:
+        await query.answer("❌ Error al publicar", show_alert=True)
+
+async def callback_cancel_upload(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Cancela la subida del contenido pendiente"""
+    await query.edit_message_text(
+        "❌ **Subida cancelada**\n\n"
+        "El archivo no se ha publicado.",
+        parse_mode='Markdown'
+    )
+    # Limpiar datos
+    if 'pending_media' in context.user_data:
+        del context.user_data['pending_media']
+    if 'media_group' in context.user_data:
+        del context.user_data['media_group']
+    if 'waiting_for' in context.user_data:
+        del context.user_data['waiting_for']
+
+# === NUEVOS CALLBACKS PARA GRUPOS DE ARCHIVOS ===
+async def callback_setup_group_description(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Pide la descripción del grupo de archivos"""
+    context.user_data['waiting_for'] = 'group_description'
+    await query.edit_message_text(
+        "📝 **Descripción del Grupo**\n\n"
+        "Envía la descripción que se aplicará a todo el grupo:",
+        parse_mode='Markdown'
+    )
+
+async def callback_setup_group_price(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra los precios para el grupo de archivos"""
+    reply_markup = GROUP_PRICE_MARKUP
     
-    # === NUEVOS CALLBACKS PARA GRUPOS DE ARCHIVOS ===
-    
-    elif data == "setup_group_description":
-        context.user_data['waiting_for'] = 'group_description'
+    await query.edit_message_text(
+        "💰 **Precio del Grupo**\n\n"
+        "Selecciona el precio único para todo el grupo:",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def callback_group_price(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Aplica el precio elegido al grupo de archivos"""
+    if data == "group_price_custom":
+        context.user_data['waiting_for'] = 'group_custom_price'
         await query.edit_message_text(
-            "📝 **Descripción del Grupo**\n\n"
-            "Envía la descripción que se aplicará a todo el grupo:",
+            "💰 **Precio Personalizado del Grupo**\n\n"
+            "Envía el número de estrellas para todo el grupo:",
             parse_mode='Markdown'
         )
-    
-    elif data == "setup_group_price":
-        price_keyboard = [
-            [InlineKeyboardButton("Gratuito (0 ⭐)", callback_data="group_price_0")],
-            [InlineKeyboardButton("5 ⭐", callback_data="group_price_5"), InlineKeyboardButton("10 ⭐", callback_data="group_price_10")],
-            [InlineKeyboardButton("25 ⭐", callback_data="group_price_25"), InlineKeyboardButton("50 ⭐", callback_data="group_price_50")],
-            [InlineKeyboardButton("100 ⭐", callback_data="group_price_100"), InlineKeyboardButton("200 ⭐", callback_data="group_price_200")],
-            [InlineKeyboardButton("✏️ Precio personalizado", callback_data="group_price_custom")],
-            [InlineKeyboardButton("⬅️ Volver", callback_data="back_to_group_setup")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(price_keyboard)
-        
-        await query.edit_message_text(
-            "💰 **Precio del Grupo**\n\n"
-            "Selecciona el precio único para todo el grupo:",
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
-    
-    elif data.startswith("group_price_"):
-        if data == "group_price_custom":
-            context.user_data['waiting_for'] = 'group_custom_price'
-            await query.edit_message_text(
-                "💰 **Precio Personalizado del Grupo**\n\n"
-                "Envía el número de estrellas para todo el grupo:",
-                parse_mode='Markdown'
-            )
-        else:
-            price = int(data.split("_")[2])
-            context.user_data['media_group']['price'] = price
-            await show_group_preview(query, context)
-    
-    elif data == "back_to_group_setup":
+    else:
+        price = int(data.rpartition("_")[2])
+        context.user_data['media_group']['price'] = price
         await show_group_preview(query, context)
+
+async def callback_back_to_group_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Vuelve a la vista previa del grupo de archivos"""
+    await show_group_preview(query, context)
+
+async def callback_publish_group(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Publica el grupo de archivos"""
+    media_group_data = context.user_data.get('media_group', {})
     
-    elif data == "publish_group":
-        media_group_data = context.user_data.get('media_group', {})
-        
-        if not media_group_data.get('description'):
-            await query.answer("❌ Falta descripción del grupo", show_alert=True)
-            return
-        
-        # Publicar grupo usando sendMediaGroup nativo
-        await publish_media_group(query, context, media_group_data)
+    if not media_group_data.get('description'):
+        await query.answer("❌ Falta descripción del grupo", show_alert=True)
+        return
     
-    # === NUEVOS CALLBACKS PARA MÚLTIPLES ARCHIVOS ===
-    elif data == "view_queue":
-        media_queue = context.user_data.get('media_queue', [])
-        
-        if not media_queue:
-            await query.answer("❌ No hay archivos en la cola", show_alert=True)
-            return
-        
-        queue_text = "📋 **Cola de Archivos:**\n\n"
-        
-        for i, item in enumerate(media_queue, 1):
-            status_icon = "✅" if item.get('title') and item.get('description') else "⏳"
-            price_text = f"{item['price']} ⭐" if item['price'] > 0 else "GRATIS"
-            
-            queue_text += f"{status_icon} **#{i}** - {item['type']} ({price_text})\n"
-            queue_text += f"📝 {item.get('title', '_Sin título_')}\n"
-            queue_text += f"📄 {item.get('description', '_Sin descripción_')[:50]}...\n\n"
-        
-        # Botones para gestionar la cola
-        keyboard = [
-            [InlineKeyboardButton("⚙️ Configurar Todo", callback_data="batch_setup")],
-            [InlineKeyboardButton("✅ Publicar Todo", callback_data="publish_all")],
-            [InlineKeyboardButton("🔄 Actualizar", callback_data="view_queue")],
-            [InlineKeyboardButton("🗑️ Limpiar Cola", callback_data="clear_queue")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            queue_text,
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
+    # Publicar grupo usando sendMediaGroup nativo
+    await publish_media_group(query, context, media_group_data)
+
+# === NUEVOS CALLBACKS PARA MÚLTIPLES ARCHIVOS ===
+async def callback_view_queue(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra la cola de archivos pendientes"""
+    media_queue = context.user_data.get('media_queue', [])
     
-    elif data == "batch_setup":
-        media_queue = context.user_data.get('media_queue', [])
-        
-        if not media_queue:
-            await query.answer("❌ No hay archivos en la cola", show_alert=True)
-            return
-        
-        keyboard = [
-            [InlineKeyboardButton("✏️ Establecer Título General", callback_data="batch_title")],
-            [InlineKeyboardButton("📝 Establecer Descripción General", callback_data="batch_description")],
-            [InlineKeyboardButton("💰 Establecer Precio General", callback_data="batch_price")],
-            [InlineKeyboardButton("🔄 Configurar Individual", callback_data="individual_setup")],
-            [InlineKeyboardButton("⬅️ Volver a Cola", callback_data="view_queue")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            f"⚙️ **Configuración Masiva**\n\n"
-            f"📊 **Archivos en cola:** {len(media_queue)}\n\n"
-            f"Elige cómo quieres configurar los archivos:",
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
+    if not media_queue:
+        await query.answer("❌ No hay archivos en la cola", show_alert=True)
+        return
     
-    elif data == "publish_all":
-        media_queue = context.user_data.get('media_queue', [])
-        
-        if not media_queue:
-            await query.answer("❌ No hay archivos para publicar", show_alert=True)
-            return
-        
-        # Verificar que todos los archivos tengan título y descripción
-        incomplete = []
-        for i, item in enumerate(media_queue):
-            if not item.get('title') or not item.get('description'):
-                incomplete.append(i + 1)
-        
-        if incomplete:
-            await query.answer(f"❌ Archivos sin configurar: #{', #'.join(map(str, incomplete))}", show_alert=True)
-            return
-        
-        await query.edit_message_text(
-            f"📡 **Publicando {len(media_queue)} archivos...**\n\n"
-            f"⏳ Por favor espera mientras se procesan todos los archivos.",
-            parse_mode='Markdown'
-        )
-        
-        published_count = 0
-        failed_count = 0
-        
-        for i, media_data in enumerate(media_queue):
-            try:
-                content_id = content_bot.add_content(
-                    media_data['title'],
-                    media_data['description'],
-                    media_data['type'],
-                    media_data['file_id'],
-                    media_data['price']
-                )
-                
-                if content_id:
-                    published_count += 1
-                    # Enviar a todos los usuarios
-                    await broadcast_new_content(context, content_id)
-                    
-                    # Pequeña pausa entre publicaciones
-                    import asyncio
-                    await asyncio.sleep(0.5)
-                else:
-                    failed_count += 1
-            except Exception as e:
-                logger.error(f"Error publicando archivo {i+1}: {e}")
-                failed_count += 1
-        
-        # Limpiar cola después de publicar
-        context.user_data['media_queue'] = []
-        
-        result_text = f"✅ **¡Publicación completada!**\n\n"
-        result_text += f"📊 **Resultados:**\n"
-        result_text += f"✅ Publicados: {published_count}\n"
-        if failed_count > 0:
-            result_text += f"❌ Fallidos: {failed_count}\n"
-        result_text += f"\n📡 **Todos los archivos han sido enviados a los usuarios**"
+    queue_text = "📋 **Cola de Archivos:**\n\n"
+    
+    for i, item in enumerate(media_queue, 1):
+        status_icon = "✅" if item.get('title') and item.get('description') else "⏳"
+        price_text = f"{item['price']} ⭐" if item['price'] > 0 else "GRATIS"
         
-        await query.edit_message_text(
-            result_text,
-            parse_mode='Markdown'
-        )
+        queue_text += f"{status_icon} **#{i}** - {item['type']} ({price_text})\n"
+        queue_text += f"📝 {item.get('title', '_Sin título_')}\n"
+        queue_text += f"📄 {item.get('description', '_Sin descripción_')[:50]}...\n\n"
     
-    elif data == "clear_queue":
-        context.user_data['media_queue'] = []
-        await query.edit_message_text(
-            "🗑️ **Cola limpiada**\n\n"
-            "Todos los archivos han sido eliminados de la cola.\n\n"
-            "Puedes empezar a enviar nuevos archivos.",
-            parse_mode='Markdown'
-        )
+    # Botones para gestionar la cola
+    reply_markup = MEDIA_QUEUE_MARKUP
     
-    elif data.startswith("batch_"):
-        batch_type = data.split("_")[1]
-        
-        if batch_type == "title":
-            context.user_data['waiting_for'] = 'batch_title'
-            await query.edit_message_text(
-                "✏️ **Título General para Todos los Archivos**\n\n"
-                "Envía el título que se aplicará a todos los archivos de la cola:\n\n"
-                "💡 Tip: Se agregará un número automáticamente a cada uno",
-                parse_mode='Markdown'
-            )
-        elif batch_type == "description":
-            context.user_data['waiting_for'] = 'batch_description'
-            await query.edit_message_text(
-                "📝 **Descripción General para Todos los Archivos**\n\n"
-                "Envía la descripción que se aplicará a todos los archivos:",
-                parse_mode='Markdown'
-            )
-        elif batch_type == "price":
-            keyboard = [
-                [InlineKeyboardButton("🆓 Gratis", callback_data="batch_price_0")],
-                [InlineKeyboardButton("⭐ 5 estrellas", callback_data="batch_price_5"),
-                 InlineKeyboardButton("⭐ 10 estrellas", callback_data="batch_price_10")],
-                [InlineKeyboardButton("⭐ 25 estrellas", callback_data="batch_price_25"),
-                 InlineKeyboardButton("⭐ 50 estrellas", callback_data="batch_price_50")],
-                [InlineKeyboardButton("⭐ 100 estrellas", callback_data="batch_price_100"),
-                 InlineKeyboardButton("⭐ 200 estrellas", callback_data="batch_price_200")],
-                [InlineKeyboardButton("💰 Precio Personalizado", callback_data="batch_custom_price")],
-                [InlineKeyboardButton("⬅️ Volver", callback_data="batch_setup")]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "💰 **Precio General para Todos los Archivos**\n\n"
-                "Selecciona el precio que se aplicará a todos los archivos:",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
+    await query.edit_message_text(
+        queue_text,
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def callback_batch_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra las opciones de configuración de la cola"""
+    media_queue = context.user_data.get('media_queue', [])
     
-    elif data.startswith("batch_price_"):
-        price = int(data.split("_")[2])
-        media_queue = context.user_data.get('media_queue', [])
-        
-        for item in media_queue:
-            item['price'] = price
-        
-        await query.edit_message_text(
-            f"✅ **Precio aplicado a todos los archivos**\n\n"
-            f"💰 **Precio:** {price} {'estrellas ⭐' if price > 0 else '(GRATIS)'}\n"
-            f"📊 **Archivos afectados:** {len(media_queue)}\n\n"
-            f"Puedes continuar configurando otros aspectos o publicar todo.",
-            parse_mode='Markdown'
-        )
+    if not media_queue:
+        await query.answer("❌ No hay archivos en la cola", show_alert=True)
+        return
     
-    elif data == "batch_custom_price":
-        context.user_data['waiting_for'] = 'batch_custom_price'
-        await query.edit_message_text(
-            "💰 **Precio Personalizado**\n\n"
-            "Envía el número de estrellas (0 para gratis):",
-            parse_mode='Markdown'
-        )
+    reply_markup = BATCH_SETUP_MARKUP
     
-    # Nuevos handlers para gestión individual de contenido
-    elif data.startswith("manage_content_"):
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-            
-        content_id = int(data.split("_")[2])
-        content = content_bot.get_content_by_id(content_id)
-        
-        if not content:
-            await query.edit_message_text("❌ Contenido no encontrado.")
-            return
-        
-        # Mostrar opciones de gestión para este contenido específico
-        keyboard = [
-            [InlineKeyboardButton("🗑️ Eliminar", callback_data=f"delete_content_{content_id}")],
-            [InlineKeyboardButton("⬅️ Volver", callback_data="admin_manage_content")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            f"⚙️ **Gestionar Contenido**\n\n"
-            f"📺 **Título:** {content['title']}\n"
-            f"📝 **Descripción:** {content['description']}\n"
-            f"💰 **Precio:** {content['price_stars']} estrellas\n"
-            f"📁 **Tipo:** {content['media_type']}\n\n"
-            f"¿Qué acción deseas realizar?",
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
+    await query.edit_message_text(
+        f"⚙️ **Configuración Masiva**\n\n"
+        f"📊 **Archivos en cola:** {len(media_queue)}\n\n"
+        f"Elige cómo quieres configurar los archivos:",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def callback_publish_all(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Publica todos los archivos de la cola"""
+    media_queue = context.user_data.get('media_queue', [])
     
-    elif data.startswith("delete_content_"):
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-            
-        content_id = int(data.split("_")[2])
-        content = content_bot.get_content_by_id(content_id)
-        
-        if not content:
-            await query.edit_message_text("❌ Contenido no encontrado.")
-            return
-        
-        # Mostrar confirmación de eliminación
-        keyboard = [
-            [InlineKeyboardButton("✅ Sí, eliminar", callback_data=f"confirm_delete_{content_id}")],
-            [InlineKeyboardButton("❌ Cancelar", callback_data=f"manage_content_{content_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            f"⚠️ **¿Eliminar contenido?**\n\n"
-            f"📺 **Título:** {content['title']}\n"
-            f"💰 **Precio:** {content['price_stars']} estrellas\n\n"
-            f"**⚠️ Esta acción no se puede deshacer.**\n"
-            f"El contenido se eliminará permanentemente.",
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
+    if not media_queue:
+        await query.answer("❌ No hay archivos para publicar", show_alert=True)
+        return
     
-    elif data.startswith("confirm_delete_"):
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-            
-        content_id = int(data.split("_")[2])
-        
-        # Ejecutar eliminación
-        if content_bot.delete_content(content_id):            
-            await query.edit_message_text(
-                f"✅ **Contenido eliminado exitosamente**\n\n"
-                f"El contenido ha sido eliminado permanentemente de la base de datos.\n\n"
-                f"💡 **Nota:** Los usuarios verán el contenido actualizado cuando inicien una nueva conversación.",
-                parse_mode='Markdown'
-            )
-        else:
-            await query.edit_message_text(
-                f"❌ **Error al eliminar**\n\n"
-                f"No se pudo eliminar el contenido. Inténtalo de nuevo.",
-                parse_mode='Markdown'
-            )
+    # Verificar que todos los archivos tengan título y descripción
+    incomplete = []
+    for i, item in enumerate(media_queue):
+        if not item.get('title') or not item.get('description'):
+            incomplete.append(i + 1)
     
+    if incomplete:
+        await query.answer(f"❌ Archivos sin configurar: #{', #'.join(map(str, incomplete))}", show_alert=True)
+        return
     
-    elif data == "clean_user_chats":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-        
-        # Limpiar chats de todos los usuarios eliminando mensajes del bot
-        users = content_bot.get_all_users()
-        
-        cleaned_count = 0
-        for user_id_clean in users:
-            try:
-                # Intentar obtener información del chat
-                try:
-                    chat = await context.bot.get_chat(user_id_clean)
-                except Exception:
-                    continue  # Usuario bloqueó el bot o chat no accesible
-                
-                # Enviar comando de limpieza (solo funciona si el usuario lo permite)
-                try:
-                    # Primero enviar mensaje informativo
-                    cleanup_msg = await context.bot.send_message(
-                        chat_id=user_id_clean,
-                        text="🧹 **Limpiando chat...**\n\nEliminando mensajes anteriores...",
-                        parse_mode='Markdown'
-                    )
-                    
-                    # Esperar un poco antes de eliminar
-                    import asyncio
-                    await asyncio.sleep(1)
-                    
-                    # Eliminar el mensaje de limpieza también
-                    await context.bot.delete_message(chat_id=user_id_clean, message_id=cleanup_msg.message_id)
-                    
-                    cleaned_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error limpiando chat de usuario {user_id_clean}: {e}")
-                
-                await asyncio.sleep(0.2)
-                
-            except Exception as e:
-                logger.error(f"Error procesando usuario {user_id_clean}: {e}")
-        
-        await query.edit_message_text(
-            f"🧹 **Limpieza completada**\n\n"
-            f"Se procesaron {cleaned_count} chats de usuarios.\n\n"
-            f"💡 **Nota:** Solo se pueden limpiar mensajes recientes del bot.",
-            parse_mode='Markdown'
-        )
+    await query.edit_message_text(
+        f"📡 **Publicando {len(media_queue)} archivos...**\n\n"
+        f"⏳ Por favor espera mientras se procesan todos los archivos.",
+        parse_mode='Markdown'
+    )
     
-    elif data == "clean_admin_chat":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-        
+    published_count = 0
+    failed_count = 0
+    
+    # Toda la cola se guarda en una sola transacción
+    content_ids = await content_bot.run(content_bot.add_content_bulk, [
+        (media_data['title'], media_data['description'], media_data['type'],
+         media_data['file_id'], media_data['price'])
+        for media_data in media_queue
+    ])
+    
+    for i, content_id in enumerate(content_ids):
         try:
-            # Enviar mensaje temporal de limpieza
-            cleanup_msg = await context.bot.send_message(
-                chat_id=user_id,
-                text="🧹 **Limpiando chat de administración...**\n\nEsto puede tomar unos segundos...",
-                parse_mode='Markdown'
-            )
-            
-            import asyncio
-            await asyncio.sleep(2)
-            
-            # Eliminar el mensaje temporal
-            try:
-                await context.bot.delete_message(chat_id=user_id, message_id=cleanup_msg.message_id)
-            except Exception:
-                pass
-            
-            # Confirmar limpieza al admin
-            await query.edit_message_text(
-                f"🧹 **Chat de administración limpiado**\n\n"
-                f"✅ Se ha intentado limpiar el chat administrativo.\n\n"
-                f"💡 **Nota:** Solo se pueden eliminar mensajes recientes del bot.",
-                parse_mode='Markdown'
-            )
-            
+            if content_id:
+                published_count += 1
+                # Enviar a todos los usuarios
+                await broadcast_new_content(context, content_id)
+                
+                # Pequeña pausa entre publicaciones
+                await asyncio.sleep(0.5)
+            else:
+                failed_count += 1
         except Exception as e:
-            logger.error(f"Error limpiando chat admin: {e}")
-            await query.edit_message_text(
-                f"❌ **Error al limpiar chat**\n\n"
-                f"Hubo un problema al limpiar el chat administrativo.",
-                parse_mode='Markdown'
-            )
+            logger.error(f"Error publicando archivo {i+1}: {e}")
+            failed_count += 1
     
-    elif data == "change_help_message":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-            
-        context.user_data['waiting_for'] = 'help_message'
+    # Limpiar cola después de publicar
+    context.user_data['media_queue'] = []
+    
+    result_text = f"✅ **¡Publicación completada!**\n\n"
+    result_text += f"📊 **Resultados:**\n"
+    result_text += f"✅ Publicados: {published_count}\n"
+    if failed_count > 0:
+        result_text += f"❌ Fallidos: {failed_count}\n"
+    result_text += f"\n📡 **Todos los archivos han sido enviados a los usuarios**"
+    
+    await query.edit_message_text(
+        result_text,
+        parse_mode='Markdown'
+    )
+
+async def callback_clear_queue(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Vacía la cola de archivos"""
+    context.user_data['media_queue'] = []
+    await query.edit_message_text(
+        "🗑️ **Cola limpiada**\n\n"
+        "Todos los archivos han sido eliminados de la cola.\n\n"
+        "Puedes empezar a enviar nuevos archivos.",
+        parse_mode='Markdown'
+    )
+
+async def callback_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Pide el título, la descripción o el precio general de la cola"""
+    batch_type = data.split("_")[1]
+    
+    if batch_type == "title":
+        context.user_data['waiting_for'] = 'batch_title'
         await query.edit_message_text(
-            "✏️ **Cambiar Mensaje de Ayuda**\n\n"
-            "Envía el nuevo mensaje que quieres que aparezca cuando los usuarios usen /ayuda\n\n"
-            "💡 **Puedes usar formato Markdown:**\n"
-            "• **texto en negrita**\n"
-            "• *texto en cursiva*\n"
-            "• `código`\n"
-            "• Emojis 🎬 ⭐ 💫",
+            "✏️ **Título General para Todos los Archivos**\n\n"
+            "Envía el título que se aplicará a todos los archivos de la cola:\n\n"
+            "💡 Tip: Se agregará un número automáticamente a cada uno",
             parse_mode='Markdown'
         )
-    
-    elif data == "preview_help_message":
-        current_message = content_bot.get_setting('help_message', 'No hay mensaje configurado')
-        
-        keyboard = [[InlineKeyboardButton("⬅️ Volver", callback_data="admin_help_message")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    elif batch_type == "description":
+        context.user_data['waiting_for'] = 'batch_description'
+        await query.edit_message_text(
+            "📝 **Descripción General para Todos los Archivos**\n\n"
+            "Envía la descripción que se aplicará a todos los archivos:",
+            parse_mode='Markdown'
+        )
+    elif batch_type == "price":
+        reply_markup = BATCH_PRICE_MARKUP
         
         await query.edit_message_text(
-            f"👀 **Vista Previa del Mensaje de Ayuda**\n\n"
-            f"Este es el mensaje que ven los usuarios:\n\n"
-            f"--- INICIO DEL MENSAJE ---\n"
-            f"{current_message}\n"
-            f"--- FIN DEL MENSAJE ---",
+            "💰 **Precio General para Todos los Archivos**\n\n"
+            "Selecciona el precio que se aplicará a todos los archivos:",
             parse_mode='Markdown',
             reply_markup=reply_markup
         )
+
+async def callback_batch_price(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Aplica el precio elegido a todos los archivos de la cola"""
+    price = int(data.rpartition("_")[2])
+    media_queue = context.user_data.get('media_queue', [])
     
-    elif data == "reset_help_message":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-            
-        # Restaurar mensaje original
-        default_message = '''📋 **Comandos Disponibles:**
+    for item in media_queue:
+        item['price'] = price
+    
+    await query.edit_message_text(
+        f"✅ **Precio aplicado a todos los archivos**\n\n"
+        f"💰 **Precio:** {price} {'estrellas ⭐' if price > 0 else '(GRATIS)'}\n"
+        f"📊 **Archivos afectados:** {len(media_queue)}\n\n"
+        f"Puedes continuar configurando otros aspectos o publicar todo.",
+        parse_mode='Markdown'
+    )
 
-🎬 *Para usuarios:*
-/start - Mensaje de bienvenida
-/catalogo - Ver contenido disponible
-/ayuda - Esta ayuda
+async def callback_batch_custom_price(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Pide un precio personalizado para la cola"""
+    context.user_data['waiting_for'] = 'batch_custom_price'
+    await query.edit_message_text(
+        "💰 **Precio Personalizado**\n\n"
+        "Envía el número de estrellas (0 para gratis):",
+        parse_mode='Markdown'
+    )
 
-💫 *Sobre las estrellas:*
-• Las estrellas ⭐ son la moneda oficial de Telegram
-• Se compran directamente en Telegram
-• Permiten acceder a contenido premium
+# Nuevos handlers para gestión individual de contenido
+@admin_only
+async def callback_manage_content(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra las opciones de gestión de un contenido"""
+    content_id = int(data[len(MANAGE_PREFIX):])
+    content = await content_bot.run(content_bot.get_content_by_id, content_id)
+    
+    if not content:
+        await query.edit_message_text("❌ Contenido no encontrado.")
+        return
+    
+    # Mostrar opciones de gestión para este contenido específico
+    keyboard = [
+        [InlineKeyboardButton("🗑️ Eliminar", callback_data=f"{DELETE_PREFIX}{content_id}")],
+        [InlineKeyboardButton("⬅️ Volver", callback_data="admin_manage_content")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        f"⚙️ **Gestionar Contenido**\n\n"
+        f"📺 **Título:** {content['title']}\n"
+        f"📝 **Descripción:** {content['description']}\n"
+        f"💰 **Precio:** {content['price_stars']} estrellas\n"
+        f"📁 **Tipo:** {content['media_type']}\n\n"
+        f"¿Qué acción deseas realizar?",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
 
-❓ *¿Necesitas ayuda?*
-Si tienes problemas, contacta al administrador del canal.'''
-        
-        if content_bot.set_setting('help_message', default_message):
-            keyboard = [[InlineKeyboardButton("⬅️ Volver", callback_data="admin_help_message")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "✅ **Mensaje Restaurado**\n\n"
-                "El mensaje de ayuda ha sido restaurado al original.\n"
-                "Los usuarios verán el mensaje predeterminado cuando usen /ayuda",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-        else:
-            await query.edit_message_text(
-                "❌ **Error**\n\n"
-                "No se pudo restaurar el mensaje. Inténtalo de nuevo.",
-                parse_mode='Markdown'
-            )
+@admin_only
+async def callback_delete_content(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Pide confirmación para eliminar un contenido"""
+    content_id = int(data[len(DELETE_PREFIX):])
+    content = await content_bot.run(content_bot.get_content_by_id, content_id)
     
-    elif data == "export_stats":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
-        
-        stats = content_bot.get_stats()
-        stats_text = (
-            f"📊 **Reporte Detallado**\n"
-            f"Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n"
-            f"👥 Usuarios: {stats['total_users']}\n"
-            f"📁 Contenido: {stats['total_content']}\n"
-            f"💰 Ventas: {stats['total_sales']}\n"
-            f"⭐ Estrellas: {stats['total_stars']}\n\n"
-            f"🏆 **Top contenido:**\n"
+    if not content:
+        await query.edit_message_text("❌ Contenido no encontrado.")
+        return
+    
+    # Mostrar confirmación de eliminación
+    keyboard = [
+        [InlineKeyboardButton("✅ Sí, eliminar", callback_data=f"{CONFIRM_DELETE_PREFIX}{content_id}")],
+        [InlineKeyboardButton("❌ Cancelar", callback_data=f"{MANAGE_PREFIX}{content_id}")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        f"⚠️ **¿Eliminar contenido?**\n\n"
+        f"📺 **Título:** {content['title']}\n"
+        f"💰 **Precio:** {content['price_stars']} estrellas\n\n"
+        f"**⚠️ Esta acción no se puede deshacer.**\n"
+        f"El contenido se eliminará permanentemente.",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@admin_only
+async def callback_confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Elimina un contenido definitivamente"""
+    content_id = int(data[len(CONFIRM_DELETE_PREFIX):])
+    
+    # Ejecutar eliminación
+    if await content_bot.run(content_bot.delete_content, content_id):            
+        await query.edit_message_text(
+            f"✅ **Contenido eliminado exitosamente**\n\n"
+            f"El contenido ha sido eliminado permanentemente de la base de datos.\n\n"
+            f"💡 **Nota:** Los usuarios verán el contenido actualizado cuando inicien una nueva conversación.",
+            parse_mode='Markdown'
+        )
+    else:
+        await query.edit_message_text(
+            f"❌ **Error al eliminar**\n\n"
+            f"No se pudo eliminar el contenido. Inténtalo de nuevo.",
+            parse_mode='Markdown'
+        )
+
+@admin_only
+async def callback_clean_user_chats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Borra los mensajes del bot en los chats de los usuarios"""
+    # Con muchos usuarios tarda minutos: se hace en segundo plano y el admin sigue usando el bot
+    context.application.create_task(clean_user_chats_job(context, query))
+    await query.edit_message_text(
+        "🚀 **Limpieza iniciada en segundo plano**\n\n"
+        "Este mensaje mostrará el progreso.",
+        parse_mode='Markdown'
+    )
+
+async def clean_user_chats_job(context: ContextTypes.DEFAULT_TYPE, query):
+    """Limpia los chats de todos los usuarios e informa del progreso en el mensaje del admin"""
+    # Limpiar chats de todos los usuarios eliminando mensajes del bot
+    async def clean_chat(user_id_clean: int) -> str:
+        # Enviar comando de limpieza (solo funciona si el usuario lo permite;
+        # si bloqueó el bot el envío falla y cuenta como no limpiado)
+        cleanup_msg = await context.bot.send_message(
+            chat_id=user_id_clean,
+            text="🧹 **Limpiando chat...**\n\nEliminando mensajes anteriores...",
+            parse_mode='Markdown'
         )
         
-        for i, (title, sales) in enumerate(stats['top_content'], 1):
-            stats_text += f"{i}. {title}: {sales} ventas\n"
+        # Esperar un poco antes de eliminar
+        await asyncio.sleep(1)
         
-        await query.edit_message_text(stats_text, parse_mode='Markdown')
+        # Eliminar el mensaje de limpieza también
+        await context.bot.delete_message(chat_id=user_id_clean, message_id=cleanup_msg.message_id)
+        return 'sent'
     
-    # Handlers para nuevos callbacks del menú de administrador
-    elif data == "quick_admin":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
+    async def report_progress(results: Counter):
+        await query.edit_message_text(
+            f"🧹 **Limpiando chats...**\n\n"
+            f"✅ Limpiados: {results['sent']}\n"
+            f"🚫 Bloquearon el bot: {results['blocked']}\n"
+            f"❌ Errores: {results['failed']}",
+            parse_mode='Markdown'
+        )
+    
+    results = await for_each_active_user(clean_chat, on_progress=report_progress)
+    
+    await query.edit_message_text(
+        f"🧹 **Limpieza completada**\n\n"
+        f"✅ Limpiados: {results['sent']}\n"
+        f"🚫 Bloquearon el bot: {results['blocked']}\n"
+        f"❌ Errores: {results['failed']}\n\n"
+        f"💡 **Nota:** Solo se pueden limpiar mensajes recientes del bot.",
+        parse_mode='Markdown'
+    )
+
+@admin_only
+async def callback_clean_admin_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Borra los mensajes recientes del chat del administrador"""
+    try:
+        # Enviar mensaje temporal de limpieza
+        cleanup_msg = await context.bot.send_message(
+            chat_id=user_id,
+            text="🧹 **Limpiando chat de administración...**\n\nEsto puede tomar unos segundos...",
+            parse_mode='Markdown'
+        )
         
-        keyboard = [
-            [InlineKeyboardButton("➕ Añadir Contenido", callback_data="admin_add_content")],
-            [InlineKeyboardButton("📋 Gestionar Contenido", callback_data="admin_manage_content")],
-            [InlineKeyboardButton("📊 Estadísticas", callback_data="admin_stats")],
-            [InlineKeyboardButton("⚙️ Configuración", callback_data="admin_settings")],
-            [InlineKeyboardButton("✏️ Mensaje de Ayuda", callback_data="admin_help_message")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await asyncio.sleep(2)
         
+        # Eliminar el mensaje temporal
+        try:
+            await context.bot.delete_message(chat_id=user_id, message_id=cleanup_msg.message_id)
+        except Exception:
+            pass
+        
+        # Confirmar limpieza al admin
         await query.edit_message_text(
-            "🔧 **Panel de Administración**\n\n"
-            "Selecciona una opción:",
-            reply_markup=reply_markup,
+            f"🧹 **Chat de administración limpiado**\n\n"
+            f"✅ Se ha intentado limpiar el chat administrativo.\n\n"
+            f"💡 **Nota:** Solo se pueden eliminar mensajes recientes del bot.",
             parse_mode='Markdown'
         )
-    
-    elif data == "quick_upload":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
         
+    except Exception as e:
+        logger.error(f"Error limpiando chat admin: {e}")
         await query.edit_message_text(
-            "➕ **Subir Contenido Rápido**\n\n"
-            "**Método Simplificado:**\n"
-            "1. Envía tu archivo (foto, video o documento)\n"
-            "2. Aparecerán botones automáticamente\n"
-            "3. Configura título, descripción y precio\n"
-            "4. ¡Listo para publicar!\n\n"
-            "**Método Tradicional:**\n"
-            "Usa: `/add_content Título|Descripción|Precio`",
+            f"❌ **Error al limpiar chat**\n\n"
+            f"Hubo un problema al limpiar el chat administrativo.",
             parse_mode='Markdown'
         )
+
+@admin_only
+async def callback_change_help_message(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Pide el nuevo mensaje de ayuda"""
+    context.user_data['waiting_for'] = 'help_message'
+    await query.edit_message_text(
+        "✏️ **Cambiar Mensaje de Ayuda**\n\n"
+        "Envía el nuevo mensaje que quieres que aparezca cuando los usuarios usen /ayuda\n\n"
+        "💡 **Puedes usar formato Markdown:**\n"
+        "• **texto en negrita**\n"
+        "• *texto en cursiva*\n"
+        "• `código`\n"
+        "• Emojis 🎬 ⭐ 💫",
+        parse_mode='Markdown'
+    )
+
+async def callback_preview_help_message(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra cómo ven los usuarios el mensaje de ayuda"""
+    current_message = await content_bot.run(content_bot.get_setting, 'help_message', 'No hay mensaje configurado')
     
-    elif data == "refresh_all_users":
-        if not content_bot.is_admin(user_id):
-            await query.edit_message_text("❌ Sin permisos de administrador.")
-            return
+    reply_markup = BACK_TO_HELP_MARKUP
+    
+    await query.edit_message_text(
+        f"👀 **Vista Previa del Mensaje de Ayuda**\n\n"
+        f"Este es el mensaje que ven los usuarios:\n\n"
+        f"--- INICIO DEL MENSAJE ---\n"
+        f"{current_message}\n"
+        f"--- FIN DEL MENSAJE ---",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+@admin_only
+async def callback_reset_help_message(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Restaura el mensaje de ayuda por defecto"""
+    # Restaurar mensaje original
+    if await content_bot.run(content_bot.set_setting, 'help_message', MESSAGES['help_message']):
+        reply_markup = BACK_TO_HELP_MARKUP
         
         await query.edit_message_text(
-            "ℹ️ **Actualización de Usuarios**\n\n"
-            "**Nota:** Los usuarios verán el contenido actualizado cuando inicien una nueva conversación con `/start`.\n\n"
-            "**¿Por qué no se actualiza automáticamente?**\n"
-            "- Evita spam a los usuarios\n"
-            "- Previene errores con usuarios que bloquearon el bot\n"
-            "- Mejor experiencia para todos\n\n"
-            "💡 **Recomendación:** Los canales reales de Telegram tampoco empujan contenido automáticamente cuando se elimina algo.",
+            "✅ **Mensaje Restaurado**\n\n"
+            "El mensaje de ayuda ha sido restaurado al original.\n"
+            "Los usuarios verán el mensaje predeterminado cuando usen /ayuda",
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
+    else:
+        await query.edit_message_text(
+            "❌ **Error**\n\n"
+            "No se pudo restaurar el mensaje. Inténtalo de nuevo.",
             parse_mode='Markdown'
         )
 
+@admin_only
+async def callback_export_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Muestra el informe completo de estadísticas"""
+    stats = await content_bot.run(content_bot.get_stats)
+    stats_text = MESSAGES['stats_report'].format(
+        date=datetime.now().strftime('%Y-%m-%d %H:%M'), **stats
+    ) + format_top_content(stats['top_content'])
+    
+    await query.edit_message_text(stats_text, parse_mode='Markdown')
+
+# Handlers para nuevos callbacks del menú de administrador
+@admin_only
+async def callback_quick_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Abre el panel de administración desde /menu"""
+    await query.edit_message_text(
+        MESSAGES['admin_panel'],
+        reply_markup=ADMIN_PANEL_MARKUP,
+        parse_mode='Markdown'
+    )
+
+@admin_only
+async def callback_quick_upload(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Explica cómo subir contenido desde /menu"""
+    await query.edit_message_text(MESSAGES['quick_upload'], parse_mode='Markdown')
+
+@admin_only
+async def callback_refresh_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE, query, data: str, user_id: int):
+    """Explica cómo se actualiza el contenido de los usuarios"""
+    await query.edit_message_text(
+        "ℹ️ **Actualización de Usuarios**\n\n"
+        "**Nota:** Los usuarios verán el contenido actualizado cuando inicien una nueva conversación con `/start`.\n\n"
+        "**¿Por qué no se actualiza automáticamente?**\n"
+        "- Evita spam a los usuarios\n"
+        "- Previene errores con usuarios que bloquearon el bot\n"
+        "- Mejor experiencia para todos\n\n"
+        "💡 **Recomendación:** Los canales reales de Telegram tampoco empujan contenido automáticamente cuando se elimina algo.",
+        parse_mode='Markdown'
+    )
+
+# Callbacks con valor fijo
+CALLBACK_HANDLERS = {
+    "admin_add_content": callback_admin_add_content,
+    "admin_manage_content": callback_admin_manage_content,
+    "admin_stats": callback_admin_stats,
+    "admin_settings": callback_admin_settings,
+    "admin_help_message": callback_admin_help_message,
+    "admin_back": callback_admin_back,
+    "setup_description": callback_setup_description,
+    "setup_price": callback_setup_price,
+    "back_to_setup": callback_back_to_setup,
+    "publish_content": callback_publish_content,
+    "cancel_upload": callback_cancel_upload,
+    "setup_group_description": callback_setup_group_description,
+    "setup_group_price": callback_setup_group_price,
+    "back_to_group_setup": callback_back_to_group_setup,
+    "publish_group": callback_publish_group,
+    "view_queue": callback_view_queue,
+    "batch_setup": callback_batch_setup,
+    "publish_all": callback_publish_all,
+    "clear_queue": callback_clear_queue,
+    "batch_custom_price": callback_batch_custom_price,
+    "clean_user_chats": callback_clean_user_chats,
+    "clean_admin_chat": callback_clean_admin_chat,
+    "change_help_message": callback_change_help_message,
+    "preview_help_message": callback_preview_help_message,
+    "reset_help_message": callback_reset_help_message,
+    "export_stats": callback_export_stats,
+    "quick_admin": callback_quick_admin,
+    "quick_upload": callback_quick_upload,
+    "refresh_all_users": callback_refresh_all_users
+}
+
+# Callbacks con parámetro, agrupados por su primera palabra y ordenados
+# del prefijo más largo al más corto (batch_price_ antes que batch_)
+CALLBACK_PREFIX_HANDLERS = {
+    "unlock": [(UNLOCK_PREFIX, callback_unlock)],
+    "view": [(VIEW_PREFIX, callback_view_content)],
+    "price": [("price_", callback_price)],
+    "group": [("group_price_", callback_group_price)],
+    "batch": [("batch_price_", callback_batch_price), ("batch_", callback_batch)],
+    "manage": [(MANAGE_PREFIX, callback_manage_content)],
+    "delete": [(DELETE_PREFIX, callback_delete_content)],
+    "confirm": [(CONFIRM_DELETE_PREFIX, callback_confirm_delete)],
+    "catalog": [(CATALOG_PAGE_PREFIX, callback_catalog_page)]
+}
+
+async def edit_preview(query, preview_text: str, reply_markup: InlineKeyboardMarkup):
+    """Edita el mensaje con la vista previa; no es un error si ya mostraba lo mismo"""
+    try:
+        await query.edit_message_text(
+            preview_text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
+    except BadRequest as e:
+        # Reabrir la vista previa sin cambios (p. ej. elegir el mismo precio)
+        if "not modified" not in str(e).lower():
+            raise
+
 async def show_content_preview(query, context: ContextTypes.DEFAULT_TYPE):
     """Muestra vista previa del contenido en configuración"""
-    media_data = context.user_data.get('pending_media', {})
+    media_data = context.user_data.get('pending_media')
     
-    description = media_data.get('description', '_No establecida_')
-    price = media_data.get('price', 0)
-    media_type = media_data.get('type', 'desconocido')
+    if media_data:
+        description, price, media_type = media_data.description, media_data.price, media_data.type
+    else:
+        description, price, media_type = '_No establecida_', 0, 'desconocido'
     
     price_text = "**Gratuito**" if price == 0 else f"**{price} estrellas**"
     
-    keyboard = [
-        [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_description")],
-        [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_price")],
-        [InlineKeyboardButton("✅ Publicar Contenido", callback_data="publish_content")],
-        [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = SETUP_MARKUP
     
     preview_text = (
         f"📁 **Archivo recibido** ({media_type})\n\n"
@@ -2126,11 +2901,7 @@ async def show_content_preview(query, context: ContextTypes.DEFAULT_TYPE):
         f"Usa los botones para configurar tu publicación:"
     )
     
-    await query.edit_message_text(
-        preview_text,
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await edit_preview(query, preview_text, reply_markup)
 
 async def show_group_preview(query, context: ContextTypes.DEFAULT_TYPE):
     """Muestra vista previa del grupo de archivos en configuración"""
@@ -2148,14 +2919,7 @@ async def show_group_preview(query, context: ContextTypes.DEFAULT_TYPE):
     video_count = sum(1 for f in files if f['type'] == 'video')
     doc_count = sum(1 for f in files if f['type'] == 'document')
     
-    keyboard = [
-        [InlineKeyboardButton("📝 Descripción del Grupo", callback_data="setup_group_description")],
-        [InlineKeyboardButton("💰 Precio del Grupo", callback_data="setup_group_price")],
-        [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
-        [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = GROUP_SETUP_MARKUP
     
     preview_text = (
         f"📦 **Grupo de archivos recibido**\n\n"
@@ -2169,11 +2933,7 @@ async def show_group_preview(query, context: ContextTypes.DEFAULT_TYPE):
         f"Se publicará como un álbum con configuración única:"
     )
     
-    await query.edit_message_text(
-        preview_text,
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await edit_preview(query, preview_text, reply_markup)
 
 async def publish_media_group(query, context: ContextTypes.DEFAULT_TYPE, group_data: dict):
     """Publica el grupo de archivos usando sendMediaGroup nativo de Telegram"""
@@ -2227,7 +2987,7 @@ async def publish_media_group(query, context: ContextTypes.DEFAULT_TYPE, group_d
             return
         
         # Guardar en base de datos como contenido de grupo
-        content_id = content_bot.add_media_group_content(description, description, files, price)  # título ahora es descripción
+        content_id = await content_bot.run(content_bot.add_media_group_content, description, description, files, price)  # título ahora es descripción
         
         if content_id:
             # Actualizar mensaje de confirmación
@@ -2265,37 +3025,27 @@ async def publish_media_group(query, context: ContextTypes.DEFAULT_TYPE, group_d
         logger.error(f"Error al publicar grupo: {e}")
         await query.answer("❌ Error al publicar el grupo", show_alert=True)
 
-async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Maneja entrada de texto para configuración de contenido"""
-    if not update.effective_user or not update.message or not update.message.text:
-        return
-        
-    user_id = update.effective_user.id
-    
-    if not content_bot.is_admin(user_id):
+    if not message.text:
         return
     
     waiting_for = context.user_data.get('waiting_for')
     
     
     if waiting_for == 'description':
-        context.user_data['pending_media']['description'] = update.message.text
-        await update.message.reply_text(
-            f"✅ **Descripción establecida:** {update.message.text}\n\n"
+        context.user_data['pending_media'].description = message.text
+        await message.reply_text(
+            f"✅ **Descripción establecida:** {message.text}\n\n"
             f"Ahora puedes continuar configurando tu publicación:",
             parse_mode='Markdown'
         )
         del context.user_data['waiting_for']
         
         # Mostrar preview actualizado
-        keyboard = [
-            [InlineKeyboardButton("📝 Cambiar Descripción", callback_data="setup_description")],
-            [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_price")],
-            [InlineKeyboardButton("✅ Publicar Contenido", callback_data="publish_content")],
-            [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
+        reply_markup = SETUP_DESCRIPTION_SET_MARKUP
+        await message.reply_text(
             "Continuar configuración:",
             reply_markup=reply_markup
         )
@@ -2303,7 +3053,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # === NUEVOS HANDLERS PARA CONFIGURACIÓN MASIVA ===
     elif waiting_for == 'batch_title':
         media_queue = context.user_data.get('media_queue', [])
-        base_title = update.message.text
+        base_title = message.text
         
         for i, item in enumerate(media_queue, 1):
             if len(media_queue) > 1:
@@ -2311,7 +3061,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 item['title'] = base_title
         
-        await update.message.reply_text(
+        await message.reply_text(
             f"✅ **Títulos establecidos para {len(media_queue)} archivos**\n\n"
             f"📝 **Título base:** {base_title}\n"
             f"💡 **Se agregó numeración automática**\n\n"
@@ -2322,12 +3072,12 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif waiting_for == 'batch_description':
         media_queue = context.user_data.get('media_queue', [])
-        description = update.message.text
+        description = message.text
         
         for item in media_queue:
             item['description'] = description
         
-        await update.message.reply_text(
+        await message.reply_text(
             f"✅ **Descripción aplicada a {len(media_queue)} archivos**\n\n"
             f"📝 **Descripción:** {description[:100]}{'...' if len(description) > 100 else ''}\n\n"
             f"Puedes continuar configurando otros aspectos.",
@@ -2337,13 +3087,13 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif waiting_for == 'batch_custom_price':
         try:
-            price = int(update.message.text)
+            price = int(message.text)
             media_queue = context.user_data.get('media_queue', [])
             
             for item in media_queue:
                 item['price'] = price
             
-            await update.message.reply_text(
+            await message.reply_text(
                 f"✅ **Precio personalizado aplicado**\n\n"
                 f"💰 **Precio:** {price} {'estrellas ⭐' if price > 0 else '(GRATIS)'}\n"
                 f"📊 **Archivos afectados:** {len(media_queue)}\n\n"
@@ -2352,7 +3102,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             del context.user_data['waiting_for']
         except ValueError:
-            await update.message.reply_text(
+            await message.reply_text(
                 "❌ **Precio inválido**\n\n"
                 "Por favor, envía un número entero (0 para gratis).",
                 parse_mode='Markdown'
@@ -2361,36 +3111,30 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # === NUEVOS HANDLERS PARA GRUPOS ===
     
     elif waiting_for == 'group_description':
-        context.user_data['media_group']['description'] = update.message.text
-        await update.message.reply_text(
-            f"✅ **Descripción del grupo establecida:** {update.message.text}\n\n"
+        context.user_data['media_group']['description'] = message.text
+        await message.reply_text(
+            f"✅ **Descripción del grupo establecida:** {message.text}\n\n"
             f"Ahora puedes continuar configurando tu grupo:",
             parse_mode='Markdown'
         )
         del context.user_data['waiting_for']
         
         # Mostrar preview del grupo actualizado
-        keyboard = [
-            [InlineKeyboardButton("📝 Cambiar Descripción", callback_data="setup_group_description")],
-            [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_group_price")],
-            [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
-            [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
+        reply_markup = GROUP_SETUP_DESCRIPTION_SET_MARKUP
+        await message.reply_text(
             "Continuar configuración del grupo:",
             reply_markup=reply_markup
         )
     
     elif waiting_for == 'group_custom_price':
         try:
-            price = int(update.message.text)
+            price = int(message.text)
             if price < 0:
-                await update.message.reply_text("❌ El precio no puede ser negativo. Inténtalo de nuevo:")
+                await message.reply_text("❌ El precio no puede ser negativo. Inténtalo de nuevo:")
                 return
             
             context.user_data['media_group']['price'] = price
-            await update.message.reply_text(
+            await message.reply_text(
                 f"✅ **Precio del grupo establecido:** {price} estrellas\n\n"
                 f"Ahora puedes continuar configurando tu grupo:",
                 parse_mode='Markdown'
@@ -2398,20 +3142,13 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             del context.user_data['waiting_for']
             
             # Mostrar preview del grupo actualizado
-            keyboard = [
-    
-                [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_group_description")],
-                [InlineKeyboardButton("💰 Cambiar Precio", callback_data="setup_group_price")],
-                [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
-                [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = GROUP_SETUP_PRICE_SET_MARKUP
+            await message.reply_text(
                 "Continuar configuración del grupo:",
                 reply_markup=reply_markup
             )
         except ValueError:
-            await update.message.reply_text(
+            await message.reply_text(
                 "❌ **Precio inválido**\n\n"
                 "Por favor, envía un número entero (0 para gratis).",
                 parse_mode='Markdown'
@@ -2419,13 +3156,13 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif waiting_for == 'custom_price':
         try:
-            price = int(update.message.text)
+            price = int(message.text)
             if price < 0:
-                await update.message.reply_text("❌ El precio no puede ser negativo. Inténtalo de nuevo:")
+                await message.reply_text("❌ El precio no puede ser negativo. Inténtalo de nuevo:")
                 return
             
-            context.user_data['pending_media']['price'] = price
-            await update.message.reply_text(
+            context.user_data['pending_media'].price = price
+            await message.reply_text(
                 f"✅ **Precio establecido:** {price} estrellas\n\n"
                 f"Ahora puedes continuar configurando tu publicación:",
                 parse_mode='Markdown'
@@ -2433,27 +3170,20 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             del context.user_data['waiting_for']
             
             # Mostrar preview actualizado
-            keyboard = [
-                [InlineKeyboardButton("✏️ Establecer Título", callback_data="setup_title")],
-                [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_description")],
-                [InlineKeyboardButton("💰 Cambiar Precio", callback_data="setup_price")],
-                [InlineKeyboardButton("✅ Publicar Contenido", callback_data="publish_content")],
-                [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            reply_markup = SETUP_PRICE_SET_MARKUP
+            await message.reply_text(
                 "Continuar configuración:",
                 reply_markup=reply_markup
             )
         except ValueError:
-            await update.message.reply_text("❌ Debes enviar un número válido. Inténtalo de nuevo:")
+            await message.reply_text("❌ Debes enviar un número válido. Inténtalo de nuevo:")
     
     elif waiting_for == 'help_message':
         # Guardar el nuevo mensaje de ayuda
-        new_message = update.message.text
+        new_message = message.text
         
-        if content_bot.set_setting('help_message', new_message):
-            await update.message.reply_text(
+        if await content_bot.run(content_bot.set_setting, 'help_message', new_message):
+            await message.reply_text(
                 f"✅ **Mensaje de Ayuda Actualizado**\n\n"
                 f"El nuevo mensaje ha sido guardado exitosamente.\n"
                 f"Los usuarios ahora verán este mensaje cuando usen /ayuda\n\n"
@@ -2462,7 +3192,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='Markdown'
             )
         else:
-            await update.message.reply_text(
+            await message.reply_text(
                 "❌ **Error**\n\n"
                 "No se pudo guardar el mensaje. Inténtalo de nuevo.",
                 parse_mode='Markdown'
@@ -2470,29 +3200,39 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         del context.user_data['waiting_for']
 
+def parse_payload(payload: str) -> Optional[int]:
+    """Extrae el content_id del payload de una factura; None si no es uno de los nuestros"""
+    prefix, _, content_id = payload.partition(PAYLOAD_PREFIX)
+    if prefix or not content_id.isdecimal():
+        return None
+    return int(content_id)
+
 async def pre_checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja la verificación previa al pago"""
     query = update.pre_checkout_query
     if not query:
         return
     
-    # Siempre aceptar el pago (aquí podrías añadir validaciones adicionales)
+    # Rechazar antes del cobro las facturas que luego no se podrían entregar
+    if parse_payload(query.invoice_payload) is None:
+        logger.error(f"Payload de pago inválido: {query.invoice_payload!r}")
+        await query.answer(ok=False, error_message="❌ Factura no válida.")
+        return
+    
     await query.answer(ok=True)
 
-async def add_content_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def add_content_command(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Comando /add_content - Añadir contenido (solo admin)"""
-    if not update.effective_user or not update.message:
-        return
-        
-    user_id = update.effective_user.id
+    user_id = user.id
     
     if not content_bot.is_admin(user_id):
-        await update.message.reply_text("❌ Solo el administrador puede usar este comando.")
+        await message.reply_text("❌ Solo el administrador puede usar este comando.")
         return
     
     # Verificar si hay argumentos
     if not context.args:
-        await update.message.reply_text(
+        await message.reply_text(
             "📝 **Uso del comando:**\n\n"
             "1. Envía primero el archivo (foto, video o documento)\n"
             "2. Luego usa: `/add_content Título|Descripción|Precio_en_estrellas`\n\n"
@@ -2509,7 +3249,7 @@ async def add_content_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         parts = content_text.split("|")
         
         if len(parts) != 3:
-            await update.message.reply_text(
+            await message.reply_text(
                 "❌ **Formato incorrecto**\n\n"
                 "Usa: `Título|Descripción|Precio_en_estrellas`",
                 parse_mode='Markdown'
@@ -2522,57 +3262,54 @@ async def add_content_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Verificar si hay media en el contexto
         if not context.user_data or 'pending_media' not in context.user_data:
-            await update.message.reply_text(
+            await message.reply_text(
                 "❌ **No hay archivo pendiente**\n\n"
                 "Primero envía el archivo y luego usa el comando.",
                 parse_mode='Markdown'
             )
             return
         
-        media_data = context.user_data.get('pending_media', {})
+        media_data = context.user_data['pending_media']
         
         # Añadir contenido
-        success = content_bot.add_content(
-            title, description, media_data['type'], 
-            media_data['file_id'], price
+        success = await content_bot.run(
+            content_bot.add_content,
+            title, description, media_data.type, 
+            media_data.file_id, price
         )
         
         if success:
-            await update.message.reply_text(
+            await message.reply_text(
                 f"✅ **Contenido añadido exitosamente**\n\n"
                 f"📺 **Título:** {title}\n"
                 f"📝 **Descripción:** {description}\n"
                 f"💰 **Precio:** {price} estrellas ⭐\n"
-                f"📁 **Tipo:** {media_data['type']}",
+                f"📁 **Tipo:** {media_data.type}",
                 parse_mode='Markdown'
             )
             # Limpiar media pendiente
             if context.user_data and 'pending_media' in context.user_data:
                 del context.user_data['pending_media']
         else:
-            await update.message.reply_text("❌ Error al añadir el contenido.")
+            await message.reply_text("❌ Error al añadir el contenido.")
     
     except ValueError:
-        await update.message.reply_text(
+        await message.reply_text(
             "❌ **Precio inválido**\n\n"
             "El precio debe ser un número entero.",
             parse_mode='Markdown'
         )
     except Exception as e:
-        await update.message.reply_text(f"❌ Error: {str(e)}")
+        await message.reply_text(f"❌ Error: {str(e)}")
 
-async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def reject_media(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
+    """Responde a los archivos enviados por usuarios que no son administradores"""
+    await message.reply_text("❌ Solo el administrador puede subir contenido.")
+
+@needs_user_message
+async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Maneja archivos de media con detección automática (como canales de Telegram)"""
-    if not update.effective_user or not update.message:
-        return
-        
-    user_id = update.effective_user.id
-    
-    if not content_bot.is_admin(user_id):
-        await update.message.reply_text("❌ Solo el administrador puede subir contenido.")
-        return
-    
-    message = update.message
     media_group_id = message.media_group_id
     
     # Determinar tipo de media y file_id
@@ -2589,7 +3326,7 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_id = message.document.file_id
         filename = message.document.file_name or "Documento"
     else:
-        await update.message.reply_text("❌ Tipo de archivo no soportado.")
+        await message.reply_text("❌ Tipo de archivo no soportado.")
         return
     
     media_item = {
@@ -2615,22 +3352,13 @@ async def handle_single_file(update: Update, context: ContextTypes.DEFAULT_TYPE,
         del context.user_data['media_queue']
     
     # Configurar archivo individual
-    context.user_data['pending_media'] = {
-        'type': media_item['type'],
-        'file_id': media_item['file_id'],
-        'filename': media_item['filename'],
-        'description': '',
-        'price': 0,
-        'is_single': True
-    }
+    context.user_data['pending_media'] = PendingMedia(
+        type=media_item['type'],
+        file_id=media_item['file_id'],
+        filename=media_item['filename']
+    )
     
-    keyboard = [
-        [InlineKeyboardButton("📝 Establecer Descripción", callback_data="setup_description")],
-        [InlineKeyboardButton("💰 Establecer Precio", callback_data="setup_price")],
-        [InlineKeyboardButton("✅ Publicar Archivo", callback_data="publish_content")],
-        [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = SINGLE_FILE_SETUP_MARKUP
     
     await update.message.reply_text(
         f"📁 **Archivo individual detectado**\n\n"
@@ -2695,13 +3423,7 @@ async def process_media_group_final(update: Update, context: ContextTypes.DEFAUL
     video_count = sum(1 for f in files if f['type'] == 'video')
     doc_count = sum(1 for f in files if f['type'] == 'document')
     
-    keyboard = [
-        [InlineKeyboardButton("📝 Descripción del Grupo", callback_data="setup_group_description")],
-        [InlineKeyboardButton("💰 Precio del Grupo", callback_data="setup_group_price")],
-        [InlineKeyboardButton("✅ Publicar Grupo", callback_data="publish_group")],
-        [InlineKeyboardButton("❌ Cancelar", callback_data="cancel_upload")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = GROUP_SETUP_MARKUP
     
     await update.effective_chat.send_message(
         f"📦 **Grupo de archivos detectado automáticamente**\n\n"
@@ -2714,35 +3436,37 @@ async def process_media_group_final(update: Update, context: ContextTypes.DEFAUL
         reply_markup=reply_markup
     )
 
-async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@needs_user_message
+async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, user: User, message: Message):
     """Maneja pagos exitosos"""
-    if not update.message or not update.message.successful_payment or not update.effective_user:
+    if not message.successful_payment:
         return
         
-    payment = update.message.successful_payment
-    user_id = update.effective_user.id
+    payment = message.successful_payment
+    user_id = user.id
     
     # Extraer content_id del payload
-    content_id = int(payment.invoice_payload.split("_")[1])
-    
-    # Registrar la compra
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO purchases (user_id, content_id, stars_paid, payment_id)
-    VALUES (?, ?, ?, ?)
-    ''', (user_id, content_id, payment.total_amount, payment.telegram_payment_charge_id))
-    
-    conn.commit()
-    conn.close()
+    content_id = parse_payload(payment.invoice_payload)
+    if content_id is None:
+        logger.error(
+            f"Payload de pago inválido: {payment.invoice_payload!r} "
+            f"(usuario {user_id}, cobro {payment.telegram_payment_charge_id})"
+        )
+        await message.reply_text("✅ Pago recibido")
+        return
     
+    # Dar acceso ya (un desbloqueo inmediato no debe pedir un segundo pago)
+    # y registrar la compra (se escribe en lote en segundo plano)
+    purchase = (user_id, content_id, payment.total_amount, payment.telegram_payment_charge_id)
+    await content_bot.run(content_bot.grant_purchases, [purchase])
+    await purchase_writer.put(purchase)
+
     # Confirmar la compra
-    content = content_bot.get_content_by_id(content_id)
+    content = await recall_content(context, content_id)
     
     # Confirmar la compra y reenviar contenido desbloqueado
     if content:
-        await update.message.reply_text(
+        await message.reply_text(
             f"✅ **¡Compra exitosa!**\n\n"
             f"**{content['title']}** desbloqueado",
             parse_mode='Markdown'
@@ -2751,27 +3475,8 @@ async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Reenviar el contenido sin spoiler con descripción traducida
         caption = content.get("description", content.get("title", "Sin descripción"))
         
-        if content['media_type'] == 'photo':
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=content['media_file_id'],
-                caption=caption,
-                parse_mode='Markdown'
-            )
-        elif content['media_type'] == 'video':
-            await context.bot.send_video(
-                chat_id=user_id,
-                video=content['media_file_id'],
-                caption=caption,
-                parse_mode='Markdown'
-            )
-        elif content['media_type'] == 'document':
-            await context.bot.send_document(
-                chat_id=user_id,
-                document=content['media_file_id'],
-                caption=caption,
-                parse_mode='Markdown'
-            )
+        if content['media_type'] in MEDIA_SENDERS:
+            await send_media(context.bot, user_id, content, caption)
         else:
             await context.bot.send_message(
                 chat_id=user_id,
@@ -2779,7 +3484,7 @@ async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 parse_mode='Markdown'
             )
     else:
-        await update.message.reply_text(
+        await message.reply_text(
             f"✅ **¡Compra exitosa!**\n\n"
             f"Pagaste: {payment.total_amount} estrellas ⭐",
             parse_mode='Markdown'
@@ -2787,21 +3492,46 @@ async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 def main():
     """Función principal"""
+    global broadcast_bucket
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN no configurado")
         return
     
-    if ADMIN_USER_ID == 0:
+    if not ADMIN_USER_IDS:
         logger.error("ADMIN_USER_ID no configurado")
         return
     
     # Crear aplicación
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Por defecto la librería usa un pool muy pequeño: los envíos concurrentes de una
+    # difusión esperarían conexión o abrirían y descartarían conexiones TLS nuevas
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(HTTP_POOL_SIZE)
+        .pool_timeout(10.0)
+        .connect_timeout(10.0)
+        .read_timeout(30.0)
+    )
+    try:
+        # Cola de salida de la librería: respeta el límite global y el de grupos
+        # y reintenta los 429 de cualquier envío, no solo de las difusiones
+        builder.rate_limiter(AIORateLimiter(
+            overall_max_rate=BROADCAST_RATE,
+            overall_time_period=1,
+            group_max_rate=20,
+            group_time_period=60,
+            max_retries=3
+        ))
+        # La librería ya marca el ritmo: las difusiones no necesitan un segundo limitador
+        broadcast_bucket = None
+    except RuntimeError:
+        # python-telegram-bot[rate-limiter] no instalado, continuar sin él
+        logger.warning("AIORateLimiter no disponible: instala python-telegram-bot[rate-limiter]")
+    application = builder.build()
     
     # Configurar menú de comandos desplegable
     async def setup_commands():
         """Configura el menú desplegable de comandos"""
-        from telegram import BotCommandScopeChat, BotCommandScopeDefault
         
         # Comandos para usuarios normales (menú básico)
         user_commands = [
@@ -2818,11 +3548,11 @@ def main():
         # Configurar comandos por defecto para usuarios normales
         await application.bot.set_my_commands(user_commands, scope=BotCommandScopeDefault())
         
-        # Configurar comandos específicos para el administrador
-        if ADMIN_USER_ID != 0:
+        # Configurar comandos específicos para cada administrador
+        for admin_id in ADMIN_USER_IDS:
             await application.bot.set_my_commands(
                 admin_commands, 
-                scope=BotCommandScopeChat(chat_id=ADMIN_USER_ID)
+                scope=BotCommandScopeChat(chat_id=admin_id)
             )
         
         logger.info("Menú de comandos configurado: usuarios normales y administrador")
@@ -2836,10 +3566,16 @@ def main():
     application.add_handler(CommandHandler("admin", admin_command))
     application.add_handler(CommandHandler("menu", menu_command))
     application.add_handler(CommandHandler("add_content", add_content_command))
-    application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO | filters.Document.ALL, handle_media))
+    
+    # Subida y configuración de contenido: el filtro de la librería descarta a los
+    # usuarios normales antes de llegar a los manejadores
+    admin_filter = filters.User(user_id=ADMIN_USER_IDS)
+    media_filter = filters.PHOTO | filters.VIDEO | filters.Document.ALL
+    application.add_handler(MessageHandler(media_filter & admin_filter, handle_media))
+    application.add_handler(MessageHandler(media_filter, reject_media))
     
     # Manejador de texto para configuración de contenido
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & admin_filter, handle_text_input))
     
     application.add_handler(CallbackQueryHandler(handle_callback))
     application.add_handler(PreCheckoutQueryHandler(pre_checkout_handler))
@@ -2851,11 +3587,6 @@ def main():
     
     if port and not pythonanywhere:
         # En Render: Ejecutar bot con servidor web
-        import threading
-        from http.server import HTTPServer, SimpleHTTPRequestHandler
-        import json
-        from datetime import datetime
-        
         class BotHTTPRequestHandler(SimpleHTTPRequestHandler):
             def do_GET(self):
                 if self.path == '/':
@@ -2887,6 +3618,7 @@ def main():
             # Configurar comandos al iniciar
             await setup_commands()
             await application.initialize()
+            await start_background_tasks(application)
             await application.start()
             await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
             
@@ -2895,10 +3627,10 @@ def main():
                 await application.updater.idle()
             finally:
                 await application.stop()
+                await stop_background_tasks(application)
                 await application.shutdown()
         
         def run_bot_sync():
-            import asyncio
             asyncio.run(run_bot())
         
         # Iniciar servidor web en hilo separado
@@ -2914,8 +3646,10 @@ def main():
         # Configurar comandos usando un handler especial
         async def post_init(application):
             await setup_commands()
+            await start_background_tasks(application)
             
         application.post_init = post_init
+        application.post_shutdown = stop_background_tasks
         application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':